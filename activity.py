@@ -0,0 +1,131 @@
+import atexit
+import logging
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import DatabaseError, connection, models
+from django.db.models import Case, Value, When
+from django.utils import timezone
+
+from .models import CustomUserModel
+from .user_cache import invalidate_user
+
+logger = logging.getLogger(__name__)
+
+
+class LoginActivityRecorder:
+    """Buffers last_login timestamps and writes them with one bulk UPDATE.
+
+    A flush happens on the first login after ``flush_interval`` seconds, and
+    a timer guarantees that no buffered login waits more than
+    ``max_staleness`` seconds when traffic stops. Whatever is still buffered
+    when the process exits is written by ``flush_at_exit``.
+    """
+
+    UPDATE_CHUNK_SIZE = 500
+
+    def __init__(self, flush_interval=10, max_staleness=60):
+        self.flush_interval = flush_interval
+        self.max_staleness = max_staleness
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._timer = None
+        # Database the buffered logins belong to
+        self._database = None
+
+    def record(self, user_id, when=None):
+        with self._lock:
+            if not self._pending:
+                self._database = connection.settings_dict['NAME']
+            self._pending[user_id] = when or timezone.now()
+            self._start_timer()
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self._flush_logging_errors()
+
+    def _start_timer(self):
+        # Called with the lock held
+        if self._timer is None:
+            self._timer = threading.Timer(self.max_staleness, self._flush_from_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_logging_errors(self):
+        # A failed last_login write must never fail the login that triggered it
+        try:
+            self.flush()
+        except DatabaseError:
+            logger.exception("Could not flush buffered last_login values, will retry")
+
+    def _flush_from_timer(self):
+        try:
+            self._flush_logging_errors()
+        finally:
+            # Timer threads get their own connection, don't leak it
+            connection.close()
+
+    def flush_at_exit(self):
+        # The test runner has already switched back from the test database by now
+        if self._pending and connection.settings_dict['NAME'] != self._database:
+            logger.warning("Not flushing %d last_login value(s) recorded against another database", len(self._pending))
+            return
+        try:
+            self.flush()
+        except DatabaseError:
+            logger.exception("Could not flush buffered last_login values at exit")
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        items = list(pending.items())
+        for start in range(0, len(items), self.UPDATE_CHUNK_SIZE):
+            chunk = items[start:start + self.UPDATE_CHUNK_SIZE]
+            try:
+                CustomUserModel.objects.filter(pk__in=[pk for pk, _ in chunk]).update(last_login=Case(
+                    *[When(pk=pk, then=Value(when)) for pk, when in chunk],
+                    output_field=models.DateTimeField(),
+                ))
+            except DatabaseError:
+                self._requeue(items[start:])
+                raise
+            # update() doesn't send post_save
+            for pk, _ in chunk:
+                invalidate_user(pk)
+        return len(items)
+
+    def _requeue(self, items):
+        """Put back logins a failed flush didn't write, for the next flush."""
+        with self._lock:
+            if not self._pending:
+                self._database = connection.settings_dict['NAME']
+            for user_id, when in items:
+                # A login recorded since the flush started is newer
+                self._pending.setdefault(user_id, when)
+            self._start_timer()
+
+
+@lru_cache(maxsize=None)
+def get_login_recorder():
+    recorder = LoginActivityRecorder(
+        flush_interval=getattr(settings, 'ACCOUNTS_LAST_LOGIN_FLUSH_INTERVAL', 10),
+        max_staleness=getattr(settings, 'ACCOUNTS_LAST_LOGIN_MAX_STALENESS', 60),
+    )
+    atexit.register(recorder.flush_at_exit)
+    return recorder
+
+
+def record_login(user):
+    get_login_recorder().record(user.pk)
+
+
+def flush_pending_logins():
+    """Write buffered logins now, for worker-exit hooks of servers that skip atexit."""
+    get_login_recorder().flush_at_exit()
@@ -1,19 +1,35 @@
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUserModel
+from django.db.models import Q
+from django.db.models.functions import Upper
+from .models import CustomUserModel, EmailOutbox, SocialIdentity
+from .pagination import KeysetPaginator
+
+
+def high_volume_admin():
+    return getattr(settings, 'ACCOUNTS_ADMIN_HIGH_VOLUME', False)
+
+class SocialIdentityInline(admin.StackedInline):
+    # Loaded on the change form only, the changelist never joins it
+    model = SocialIdentity
+    fields = ['google_id', 'picture_url', 'picture', 'picture_etag', 'picture_last_modified']
+    readonly_fields = ['picture_etag', 'picture_last_modified']
+    can_delete = False
+    extra = 0
 
 @admin.register(CustomUserModel)
 class CustomUserAdmin(UserAdmin):
     list_display = ['email', 'first_name', 'last_name', 'is_active', 'is_staff', 'date_joined']
     search_fields = ['email', 'first_name', 'last_name']
     readonly_fields = ['date_joined', 'last_login']
+    inlines = [SocialIdentityInline]
 
     fieldsets = (
         (None, {'fields': ('email', 'password')}),
-        ('Personal Info', {'fields': ('first_name', 'last_name', 'google_id', 'picture_url', 'picture', 'verified_email')}),
+        ('Personal Info', {'fields': ('first_name', 'last_name', 'verified_email')}),
         ('Permissions', {'fields': ('is_active', 'is_staff', 'is_superuser')}),
         ('Important dates', {'fields': ('last_login',)}),
-        ('OPT', {'fields':('otp_code', 'otp_generated_at')})
     )
 
     add_fieldsets = (
@@ -28,3 +44,38 @@ class CustomUserAdmin(UserAdmin):
     def get_queryset(self, request):
         return super().get_queryset(request).order_by('-date_joined')
 
+    # High-volume mode (ACCOUNTS_ADMIN_HIGH_VOLUME): no exact COUNT(*),
+    # keyset pagination and index-friendly prefix search.
+
+    @property
+    def show_full_result_count(self):
+        return not high_volume_admin()
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        if high_volume_admin():
+            return KeysetPaginator(queryset, per_page, orphans, allow_empty_first_page)
+        return super().get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not high_volume_admin() or not search_term:
+            return super().get_search_results(request, queryset, search_term)
+
+        if '@' in search_term:
+            # Full address: exact lookup on the unique email index
+            return queryset.filter(email=CustomUserModel.objects.normalize_email(search_term)), False
+        # Emails are stored lowercased and names are indexed on UPPER(), so
+        # each prefix match can use an index (istartswith would not)
+        name_prefix = search_term.upper()
+        return queryset.alias(first_name_upper=Upper('first_name'), last_name_upper=Upper('last_name')).filter(
+            Q(email__startswith=CustomUserModel.objects.normalize_email(search_term))
+            | Q(first_name_upper__startswith=name_prefix) | Q(last_name_upper__startswith=name_prefix)
+        ), False
+
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'to', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at']
+    list_filter = ['status']
+    readonly_fields = ['created_at', 'sent_at']
+    ordering = ['-created_at']
@@ -0,0 +1,20 @@
+from django.urls import path
+from . import async_views
+from .views import BulkRegistrationView, MetricsView, TokenRefreshView
+
+# Same routes and names as urls.py, served by native async views where it pays off
+urlpatterns = [
+    path('register/', async_views.UserRegistrationView.as_view(), name='user-register'),
+    path('register/bulk/', BulkRegistrationView.as_view(), name='user-register-bulk'),
+    path('activate/', async_views.ActivateAccountView.as_view(), name='activate-account'),
+    path('validate/', async_views.EmailValidateRequestView.as_view(), name='email-validate'),
+    path('login/', async_views.LoginView.as_view(), name='login'),
+    path('google-login/', async_views.GoogleLoginView.as_view(), name='google-login'),
+    path('change-password/', async_views.ChangePasswordView.as_view(), name='change-password'),
+    path('set-password/', async_views.SetPasswordView.as_view(), name='set-password'),
+    path('password-reset/', async_views.PasswordResetRequestView.as_view(), name='password-reset'),
+    path('password-reset/confirm/<uidb64>/<token>/', async_views.PasswordResetConfirmView.as_view(), name='password-reset-confirm'),
+    path('me/', async_views.MeView.as_view(), name='me'),
+    path('token/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+]
@@ -0,0 +1,361 @@
+import asyncio
+import contextvars
+import functools
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.tokens import default_token_generator
+from django.db import transaction
+from django.http import JsonResponse, QueryDict
+from django.urls import reverse
+from django.utils import encoding
+from django.utils.cache import get_conditional_response
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+from django.views import View
+from rest_framework import exceptions, serializers, status
+from rest_framework.settings import api_settings
+
+from .activity import record_login
+from .authentication import CachedJWTAuthentication
+from .avatars import refresh_avatar
+from .coalescing import get_coalescer
+from .google_oauth import GoogleOAuthError, get_async_google_client, get_google_client
+from .hashing import get_hashing_service
+from .metrics import InstrumentedAsyncViewMixin
+from .models import CustomUserModel
+from .otp import consume_otp, issue_otp
+from .profiles import current_profile_etag, get_profile
+from .revocation import revoke_tokens
+from .serializers import (
+    ChangePasswordSerializer, EmailValidateRequestSerializer, GoogleLoginSerializer, LoginSerializer,
+    PasswordResetConfirmSerializer, PasswordResetRequestSerializer, SetPasswordSerializer,
+    UserRegistrationSerializer,
+)
+from .throttling import CredentialAttemptThrottle, reset_email_attempts
+from .tokens import issue_tokens_for
+from .user_cache import invalidate_user
+from .utils import send_activation_email, send_password_reset_email
+
+
+@lru_cache(maxsize=None)
+def get_hash_executor():
+    """Bounded pool that runs (or waits on) password hashing off the event loop."""
+    return ThreadPoolExecutor(
+        max_workers=getattr(settings, 'ACCOUNTS_ASYNC_HASH_WORKERS', os.cpu_count() or 1),
+        thread_name_prefix='accounts-hash',
+    )
+
+
+async def run_hashing(func, *args):
+    # Copy the context so metrics stay labelled with the calling view
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        get_hash_executor(), functools.partial(context.run, func, *args),
+    )
+
+
+def hash_password(raw_password):
+    return get_hashing_service().hash(raw_password)
+
+
+def verify_password(raw_password, encoded):
+    """check_password without the upgrade write; returns ``(valid, must_update)``."""
+    return get_hashing_service().verify(raw_password, encoded)
+
+
+class AsyncAPIView(InstrumentedAsyncViewMixin, View):
+    """Async stand-in for the DRF generics of views.py.
+
+    Bodies are validated with the same serializers and errors are rendered
+    like DRF's exception handler, so clients can't tell the two apart.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # Token authenticated API, like DRF's APIView
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return self.handle_exception(request, exc)
+
+    def handle_exception(self, request, exc):
+        data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+        response = JsonResponse(data, status=exc.status_code, safe=False)
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            response['WWW-Authenticate'] = CachedJWTAuthentication().authenticate_header(request)
+        if getattr(exc, 'wait', None):
+            response['Retry-After'] = str(int(exc.wait))
+        return response
+
+    def parse(self, request):
+        if request.content_type == 'application/json':
+            try:
+                return json.loads(request.body or b'{}')
+            except ValueError as exc:
+                raise exceptions.ParseError(f'JSON parse error - {exc}')
+        if request.method == 'POST':
+            return request.POST
+        return QueryDict(request.body)
+
+    def validate(self, serializer_class, request):
+        serializer = serializer_class(data=self.parse(request))
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    async def authenticate(self, request):
+        result = await sync_to_async(CachedJWTAuthentication().authenticate)(request)
+        if result is None:
+            raise exceptions.NotAuthenticated()
+        return result[0]
+
+    async def throttle(self, request, email):
+        throttle = CredentialAttemptThrottle()
+        wait = await sync_to_async(throttle.check)(throttle.get_ident(request), email)
+        if wait:
+            raise exceptions.Throttled(wait)
+
+
+def _finish_login(user):
+    record_login(user)
+    return issue_tokens_for(user)
+
+
+class UserRegistrationView(AsyncAPIView):
+    async def post(self, request, *args, **kwargs):
+        serializer = UserRegistrationSerializer(data=self.parse(request))
+        # The unique email validator queries the database
+        await sync_to_async(serializer.is_valid)(raise_exception=True)
+        password = await run_hashing(hash_password, serializer.validated_data['password'])
+        activation_url = request.build_absolute_uri(reverse('activate-account'))
+        await sync_to_async(self.register)(serializer.validated_data, password, activation_url)
+        return JsonResponse({'message': 'Activation email has been sent successfully.'}, status=status.HTTP_201_CREATED)
+
+    @staticmethod
+    @transaction.atomic
+    def register(data, password, activation_url):
+        email = CustomUserModel.objects.normalize_email(data['email'])
+        CustomUserModel.objects.create(**dict(data, email=email, password=password))
+        otp_code = issue_otp(email)
+        send_activation_email(email, otp_code, activation_url + f'?otp={otp_code}&email={email}')
+
+
+class EmailValidateRequestView(AsyncAPIView):
+    async def post(self, request, *args, **kwargs):
+        email = self.validate(EmailValidateRequestSerializer, request)['email']
+        user = await CustomUserModel.objects.filter(email=email, is_active=False).afirst()
+        if user is not None:
+            activation_url = request.build_absolute_uri(reverse('activate-account'))
+            await sync_to_async(self.resend)(user.email, activation_url)
+        # Same answer for unknown emails, so the endpoint doesn't reveal which accounts exist
+        return JsonResponse({"message": "If an inactive account uses this email, a new OTP has been sent."}, status=status.HTTP_201_CREATED)
+
+    @staticmethod
+    @transaction.atomic
+    def resend(email, activation_url):
+        with get_coalescer().claim('otp', email) as issue:
+            if issue:
+                otp_code = issue_otp(email)
+                send_activation_email(email, otp_code, activation_url + f'?otp={otp_code}&email={email}')
+
+
+class ActivateAccountView(AsyncAPIView):
+    async def get(self, request, *args, **kwargs):
+        otp_code = request.GET.get('otp')
+        email = request.GET.get('email')
+
+        if not otp_code or not email:
+            return JsonResponse({"error": "OTP and email are required in query parameters."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return await self.activate_account(email, otp_code)
+
+    async def post(self, request, *args, **kwargs):
+        data = self.parse(request)
+        return await self.activate_account(data.get('email'), data.get('otp'))
+
+    async def activate_account(self, email, otp_code):
+        error = await sync_to_async(self.activate)(email, otp_code)
+        if error:
+            return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+        return JsonResponse({"message": "Your account has been activated successfully."}, status=status.HTTP_200_OK)
+
+    @staticmethod
+    @transaction.atomic
+    def activate(email, otp_code):
+        email = CustomUserModel.objects.normalize_email(email)
+        # consume_otp and the UPDATE must commit together
+        if not consume_otp(email, otp_code):
+            return "Invalid or expired OTP."
+        user_id = CustomUserModel.objects.filter(email=email).values_list('pk', flat=True).first()
+        if user_id is None:
+            return "User not found."
+        CustomUserModel.objects.filter(pk=user_id).update(is_active=True, verified_email=True)
+        invalidate_user(user_id)
+
+
+class LoginFieldsSerializer(LoginSerializer):
+    # The credentials are checked by the view, outside the event loop
+    def validate(self, data):
+        return data
+
+
+class LoginView(AsyncAPIView):
+    async def post(self, request, *args, **kwargs):
+        data = self.parse(request)
+        email = data.get('email') if hasattr(data, 'get') else None
+        await self.throttle(request, email.strip().lower() if isinstance(email, str) else None)
+
+        serializer = LoginFieldsSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        email, password = serializer.validated_data['email'], serializer.validated_data['password']
+
+        # Through authenticate(), like the sync view, so AUTHENTICATION_BACKENDS
+        # and the user_login_failed signal apply here too
+        user = await sync_to_async(authenticate)(request, email=email, password=password)
+        if user is None:
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: ["Invalid email or password."]})
+
+        await sync_to_async(reset_email_attempts)(user.email)
+        return JsonResponse(await sync_to_async(_finish_login)(user), status=status.HTTP_200_OK)
+
+
+class GoogleLoginView(AsyncAPIView):
+    async def post(self, request, *args, **kwargs):
+        code = self.validate(GoogleLoginSerializer, request)['code']
+
+        try:
+            client = get_async_google_client()
+            if client is not None:
+                user_info = await client.get_user_info(code)
+            else:
+                # Without httpx the blocking client runs outside the loop
+                user_info = await sync_to_async(get_google_client().get_user_info, thread_sensitive=False)(code)
+        except GoogleOAuthError as exc:
+            return JsonResponse({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        email = user_info.get('email')
+        if not email:
+            return JsonResponse({"error": "Failed to obtain user email."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return JsonResponse(await sync_to_async(self.login)(email, user_info), status=status.HTTP_200_OK)
+
+    @staticmethod
+    def login(email, user_info):
+        user, _ = CustomUserModel.objects.upsert_google_user(
+            email,
+            first_name=user_info.get('given_name'),
+            last_name=user_info.get('family_name'),
+            google_id=user_info.get('id'),
+            picture_url=user_info.get('picture'),
+            verified_email=user_info.get('verified_email', False),
+        )
+        refresh_avatar(user)
+        return _finish_login(user)
+
+
+class ChangePasswordFieldsSerializer(ChangePasswordSerializer):
+    # The old password is checked by the view, off the event loop
+    def validate_old_password(self, value):
+        return value
+
+
+class ChangePasswordView(AsyncAPIView):
+    async def put(self, request, *args, **kwargs):
+        user = await self.authenticate(request)
+        await self.throttle(request, user.email.lower())
+
+        serializer = ChangePasswordFieldsSerializer(data=self.parse(request))
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        valid, _ = await run_hashing(verify_password, serializer.validated_data['old_password'], user.password)
+        if not valid:
+            return JsonResponse({"old_password": ["Old password is not correct"]}, status=status.HTTP_400_BAD_REQUEST)
+        await sync_to_async(reset_email_attempts)(user.email)
+
+        user.password = await run_hashing(hash_password, serializer.validated_data['new_password'])
+        await user.asave(update_fields=['password'])
+        await sync_to_async(revoke_tokens)(user)
+        return JsonResponse({"detail": "Password updated successfully"}, status=status.HTTP_200_OK)
+
+    patch = put
+
+
+class SetPasswordView(AsyncAPIView):
+    async def put(self, request, *args, **kwargs):
+        user = await self.authenticate(request)
+
+        serializer = SetPasswordSerializer(data=self.parse(request))
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        user.password = await run_hashing(hash_password, serializer.validated_data['new_password'])
+        await user.asave(update_fields=['password'])
+        await sync_to_async(revoke_tokens)(user)
+        return JsonResponse({"detail": "Password set successfully"}, status=status.HTTP_200_OK)
+
+    patch = put
+
+
+class PasswordResetRequestView(AsyncAPIView):
+    async def post(self, request, *args, **kwargs):
+        email = self.validate(PasswordResetRequestSerializer, request)['email']
+        user = await CustomUserModel.objects.filter(email=email, is_active=True).afirst()
+        if user is not None:
+            token = default_token_generator.make_token(user)
+            reset_link = request.build_absolute_uri(reverse('password-reset-confirm', kwargs={'uidb64': urlsafe_base64_encode(force_bytes(user.pk)), 'token': token}))
+            await sync_to_async(self.send)(user.email, reset_link)
+        # Same answer for unknown emails, so the endpoint doesn't reveal which accounts exist
+        return JsonResponse({"message": "If an active account uses this email, a password reset link has been sent."}, status=status.HTTP_200_OK)
+
+    @staticmethod
+    @transaction.atomic
+    def send(email, reset_link):
+        with get_coalescer().claim('password_reset', email) as issue:
+            if issue:
+                send_password_reset_email(email, reset_link)
+
+
+class PasswordResetConfirmView(AsyncAPIView):
+    async def put(self, request, uidb64, token, *args, **kwargs):
+        new_password = self.validate(PasswordResetConfirmSerializer, request)['new_password']
+
+        try:
+            uid = encoding.force_str(urlsafe_base64_decode(uidb64))
+            user = await CustomUserModel.objects.aget(pk=uid)
+        except (TypeError, ValueError, OverflowError, CustomUserModel.DoesNotExist):
+            return JsonResponse({"error": "Invalid user id or token."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not default_token_generator.check_token(user, token):
+            return JsonResponse({"error": "Invalid token. Please request a new password reset."}, status=status.HTTP_400_BAD_REQUEST)
+
+        user.password = await run_hashing(hash_password, new_password)
+        await user.asave(update_fields=['password'])
+        await sync_to_async(revoke_tokens)(user)
+        await sync_to_async(get_coalescer().release)('password_reset', user.email)
+        return JsonResponse({"message": "Password has been reset successfully."}, status=status.HTTP_200_OK)
+
+    patch = put
+
+
+class MeView(AsyncAPIView):
+    async def get(self, request, *args, **kwargs):
+        user = await self.authenticate(request)
+        etag = await sync_to_async(current_profile_etag)(user.pk)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            etag, payload = await sync_to_async(get_profile)(user.pk)
+            response = JsonResponse(payload, status=status.HTTP_200_OK)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
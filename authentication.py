@@ -0,0 +1,40 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .revocation import get_revocation_map
+from .tokens import GENERATION_CLAIM
+from .user_cache import get_user_cache
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that resolves the user through the user cache.
+
+    Authenticated endpoints don't query the user table once the user is
+    cached; the cache is invalidated whenever the user row is saved.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = get_user_cache().get(user_id)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if getattr(api_settings, 'CHECK_USER_IS_ACTIVE', True) and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if get_revocation_map().is_revoked(user.pk, validated_token.get(GENERATION_CLAIM)):
+            raise AuthenticationFailed(_("Token has been revoked"), code="token_revoked")
+
+        if getattr(api_settings, 'CHECK_REVOKE_TOKEN', False):
+            from rest_framework_simplejwt.utils import get_md5_hash_password
+
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
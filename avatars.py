@@ -0,0 +1,152 @@
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .metrics import timed
+from .models import SocialIdentity
+from .routers import pin_to_primary
+from .user_cache import invalidate_user
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_TO = 'user_pictures/'
+
+
+class AvatarError(Exception):
+    pass
+
+
+class AvatarFetcher:
+    """Copies remote profile pictures into ``SocialIdentity.picture``.
+
+    Downloads are streamed with a size cap and made conditional on the
+    ETag / Last-Modified of the previous fetch, so an unchanged avatar costs
+    a 304. Thumbnails are named after the hash of their content: identical
+    pictures share one file that can be served with far-future cache headers.
+    """
+
+    def __init__(self, size=128, max_bytes=5 * 1024 * 1024, timeout=(3.05, 10), workers=2):
+        self.size = size
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='accounts-avatar')
+
+    def download(self, url, etag=None, last_modified=None):
+        """Return ``(content, etag, last_modified)``, or None when not modified."""
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        try:
+            with timed('avatar_http'), self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+                if response.status_code == 304:
+                    return None
+                response.raise_for_status()
+                if int(response.headers.get('Content-Length') or 0) > self.max_bytes:
+                    raise AvatarError("Picture is too large.")
+
+                buffer = bytearray()
+                for chunk in response.iter_content(64 * 1024):
+                    buffer += chunk
+                    if len(buffer) > self.max_bytes:
+                        raise AvatarError("Picture is too large.")
+                return bytes(buffer), response.headers.get('ETag'), response.headers.get('Last-Modified')
+        except requests.RequestException as exc:
+            raise AvatarError(f"Failed to download picture: {exc}")
+
+    def thumbnail(self, content):
+        try:
+            with Image.open(io.BytesIO(content)) as image:
+                image = ImageOps.fit(ImageOps.exif_transpose(image).convert('RGB'), (self.size, self.size))
+        except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+            raise AvatarError("Not a valid image.")
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=85, optimize=True)
+        return output.getvalue()
+
+    def store(self, thumbnail):
+        name = f'{UPLOAD_TO}{hashlib.sha256(thumbnail).hexdigest()}.jpg'
+        if not default_storage.exists(name):
+            name = default_storage.save(name, ContentFile(thumbnail))
+        return name
+
+    def ingest(self, user_id):
+        """Fetch the user's ``picture_url`` into ``picture``; True when it changed."""
+        # Scheduled right after the login wrote picture_url, a replica may not have it yet
+        with pin_to_primary():
+            row = SocialIdentity.objects.filter(pk=user_id).values(
+                'picture_url', 'picture', 'picture_etag', 'picture_last_modified',
+            ).first()
+        if not row or not row['picture_url']:
+            return False
+
+        # Only revalidate when we still hold the picture the validators belong to
+        validators = (row['picture_etag'], row['picture_last_modified']) if row['picture'] else (None, None)
+        result = self.download(row['picture_url'], *validators)
+        if result is None:
+            return False
+
+        content, etag, last_modified = result
+        name = self.store(self.thumbnail(content))
+        # The URL may have changed again while we were downloading
+        updated = SocialIdentity.objects.filter(pk=user_id, picture_url=row['picture_url']).update(
+            picture=name, picture_etag=etag, picture_last_modified=last_modified,
+        )
+        if updated:
+            invalidate_user(user_id)
+        return bool(updated)
+
+    def _ingest_in_background(self, user_id):
+        try:
+            self.ingest(user_id)
+        except AvatarError as exc:
+            logger.warning("Avatar ingestion failed for user %s: %s", user_id, exc)
+        except Exception:
+            logger.exception("Avatar ingestion failed for user %s", user_id)
+        finally:
+            # Worker threads get their own connection, don't leak it
+            connection.close()
+
+    def schedule(self, user_id):
+        # Wait for the login transaction so the worker sees the new picture_url
+        transaction.on_commit(lambda: self.executor.submit(self._ingest_in_background, user_id))
+
+
+@lru_cache(maxsize=None)
+def get_avatar_fetcher():
+    return AvatarFetcher(
+        size=getattr(settings, 'ACCOUNTS_AVATAR_SIZE', 128),
+        max_bytes=getattr(settings, 'ACCOUNTS_AVATAR_MAX_BYTES', 5 * 1024 * 1024),
+        timeout=getattr(settings, 'ACCOUNTS_AVATAR_TIMEOUT', (3.05, 10)),
+        workers=getattr(settings, 'ACCOUNTS_AVATAR_WORKERS', 2),
+    )
+
+
+def refresh_avatar(user):
+    """Queue a background refresh of the user's picture from their ``picture_url``.
+
+    A given URL is revalidated at most once per ``ACCOUNTS_AVATAR_REFRESH_INTERVAL``;
+    a new URL is fetched right away. ``user.social_identity`` should already
+    be loaded, as ``upsert_google_user`` does.
+    """
+    # RelatedObjectDoesNotExist is an AttributeError
+    identity = getattr(user, 'social_identity', None)
+    if identity is None or not identity.picture_url:
+        return
+    digest = hashlib.sha1(identity.picture_url.encode()).hexdigest()
+    interval = getattr(settings, 'ACCOUNTS_AVATAR_REFRESH_INTERVAL', 24 * 3600)
+    if cache.add(f'accounts:avatar:{identity.user_id}:{digest}', True, timeout=interval):
+        get_avatar_fetcher().schedule(identity.user_id)
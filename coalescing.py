@@ -0,0 +1,77 @@
+import hashlib
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _incr_stat(kind, outcome):
+    with _stats_lock:
+        _stats[(kind, outcome)] += 1
+
+
+def coalescing_stats():
+    """Snapshot of ``{(kind, outcome): count}`` since process start."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+class RequestCoalescer:
+    """Lets one token or OTP email per address through every ``window`` seconds.
+
+    The first request claims a cache key with ``add()``; repeats inside the
+    window find it taken and are answered without touching the database or
+    sending anything, the user already has a live token in their inbox.
+    """
+
+    def __init__(self, window=60, cache_alias='default'):
+        self.window = window
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _key(self, kind, email):
+        digest = hashlib.sha1(email.strip().lower().encode()).hexdigest()
+        return f'accounts:coalesce:{kind}:{digest}'
+
+    @contextmanager
+    def claim(self, kind, email):
+        """Yield True when the caller should issue, False when coalesced.
+
+        The claim is released if issuing fails, so the next request retries.
+        """
+        if not self.window:
+            yield True
+            return
+
+        key = self._key(kind, email)
+        if not self.cache.add(key, True, timeout=self.window):
+            _incr_stat(kind, 'coalesced')
+            yield False
+            return
+
+        try:
+            yield True
+        except BaseException:
+            self.cache.delete(key)
+            raise
+        _incr_stat(kind, 'issued')
+
+    def release(self, kind, email):
+        self.cache.delete(self._key(kind, email))
+
+
+@lru_cache(maxsize=None)
+def get_coalescer():
+    return RequestCoalescer(
+        window=getattr(settings, 'ACCOUNTS_COALESCE_WINDOW', 60),
+        cache_alias=getattr(settings, 'ACCOUNTS_COALESCE_CACHE', 'default'),
+    )
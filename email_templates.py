@@ -0,0 +1,220 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.html import escape
+from django.utils.translation import get_language
+
+# Only these values change from one message to the next, everything else is
+# baked into the compiled template once per locale.
+PLACEHOLDER_RE = re.compile(r'\{(otp_code|activation_link|reset_link)\}')
+
+DEFAULT_LOCALE = 'en'
+
+_STYLE = """
+        body {
+            background-color: #f3f4f6;
+            font-family: Arial, sans-serif;
+            display: flex;
+            justify-content: center;
+            align-items: center;
+            height: 100vh;
+            margin: 0;
+        }
+        .container {
+            max-width: 600px;
+            padding: 20px;
+            background-color: #ffffff;
+            border: 1px solid #ccc;
+            border-radius: 8px;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+            text-align: center;
+            margin: 0 auto;
+        }
+        .btn {
+            display: inline-block;
+            padding: 10px 20px;
+            background-color: #007bff;
+            color: #fff;
+            text-decoration: none;
+            border-radius: 3px;
+            margin-top: 20px;
+            font-size: 1.2rem;
+        }
+        .otp-code {
+            font-size: 2rem;
+            font-weight: 600;
+            margin-top: 1.3rem;
+        }
+"""
+
+_LAYOUT = """<!DOCTYPE html>
+<html lang="%(lang)s">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>%(subject)s</title>
+    <style>%(style)s    </style>
+</head>
+<body>
+    <div class="container">
+        <h2 style="font-size: 1.5rem; font-weight: 600; margin-bottom: 1rem;">%(subject)s</h2>
+        <p>%(greeting)s</p>
+%(body)s
+        <p>%(regards)s<br>%(team)s</p>
+    </div>
+</body>
+</html>
+"""
+
+_ACTIVATION_HTML_BODY = """        <p>%(intro)s</p>
+        <p class="otp-code">{otp_code}</p>
+        <hr style="margin: 20px 0;">
+        %(or)s
+        <hr style="margin: 20px 0;">
+        <a href="{activation_link}" class="btn">%(button)s</a>
+        <p style="margin-top: 20px;">%(validity)s</p>"""
+
+_ACTIVATION_TEXT = """%(greeting)s
+
+%(intro)s
+
+{otp_code}
+
+%(link_intro)s
+{activation_link}
+
+%(validity)s
+
+%(regards)s
+%(team)s
+"""
+
+_PASSWORD_RESET_HTML_BODY = """        <p>%(intro)s</p>
+        <a href="{reset_link}" class="btn">%(button)s</a>
+        <p style="margin-top: 20px;">%(ignore)s</p>"""
+
+_PASSWORD_RESET_TEXT = """%(greeting)s
+
+%(intro)s
+
+{reset_link}
+
+%(ignore)s
+
+%(regards)s
+%(team)s
+"""
+
+EMAIL_TEMPLATES = {
+    'activation': {
+        'html': _ACTIVATION_HTML_BODY,
+        'text': _ACTIVATION_TEXT,
+        'strings': {
+            'en': {
+                'subject': 'Activate Your Account',
+                'greeting': 'Hello,',
+                'intro': 'Thank you for registering with X-TECH. Your OTP for account activation is:',
+                'or': 'or',
+                'link_intro': 'Or activate your account with this link:',
+                'button': 'Activate Account',
+                'validity': 'This OTP is valid for 3 hours.',
+                'regards': 'Regards,',
+                'team': 'The X-TECH Team',
+            },
+            'fr': {
+                'subject': 'Activez votre compte',
+                'greeting': 'Bonjour,',
+                'intro': "Merci de vous être inscrit sur X-TECH. Votre code OTP d'activation est :",
+                'or': 'ou',
+                'link_intro': 'Ou activez votre compte avec ce lien :',
+                'button': 'Activer mon compte',
+                'validity': 'Ce code OTP est valable 3 heures.',
+                'regards': 'Cordialement,',
+                'team': "L'équipe X-TECH",
+            },
+        },
+    },
+    'password_reset': {
+        'html': _PASSWORD_RESET_HTML_BODY,
+        'text': _PASSWORD_RESET_TEXT,
+        'strings': {
+            'en': {
+                'subject': 'Password Reset Request',
+                'greeting': 'Hello,',
+                'intro': 'We received a request to reset your password. Click the button below to proceed:',
+                'button': 'Reset Password',
+                'ignore': 'If you did not request this, you can safely ignore this email.',
+                'regards': 'Regards,',
+                'team': 'The X-TECH Team',
+            },
+            'fr': {
+                'subject': 'Réinitialisation du mot de passe',
+                'greeting': 'Bonjour,',
+                'intro': 'Nous avons reçu une demande de réinitialisation de votre mot de passe. Cliquez sur le bouton ci-dessous pour continuer :',
+                'button': 'Réinitialiser le mot de passe',
+                'ignore': "Si vous n'êtes pas à l'origine de cette demande, vous pouvez ignorer cet email.",
+                'regards': 'Cordialement,',
+                'team': "L'équipe X-TECH",
+            },
+        },
+    },
+}
+
+
+class CompiledTemplate:
+    """A skeleton split once into literal chunks and placeholder names."""
+
+    def __init__(self, source, autoescape=False):
+        parts = PLACEHOLDER_RE.split(source)
+        self.literals = parts[0::2]
+        self.keys = parts[1::2]
+        self.autoescape = autoescape
+
+    def render(self, context):
+        chunks = [self.literals[0]]
+        for key, literal in zip(self.keys, self.literals[1:]):
+            value = str(context[key])
+            chunks.append(escape(value) if self.autoescape else value)
+            chunks.append(literal)
+        return ''.join(chunks)
+
+
+class EmailTemplate:
+    def __init__(self, subject, html, text):
+        self.subject = subject
+        self.html = CompiledTemplate(html, autoescape=True)
+        self.text = CompiledTemplate(text)
+
+    def render(self, **context):
+        return self.subject, self.text.render(context), self.html.render(context)
+
+
+def resolve_locale(name, locale=None):
+    """Pick the closest available variant: 'fr-ca' -> 'fr' -> default."""
+    available = EMAIL_TEMPLATES[name]['strings']
+    locale = (locale or get_language() or getattr(settings, 'LANGUAGE_CODE', DEFAULT_LOCALE)).lower()
+    for candidate in (locale, locale.split('-')[0].split('_')[0]):
+        if candidate in available:
+            return candidate
+    return DEFAULT_LOCALE
+
+
+@lru_cache(maxsize=None)
+def _compile(name, locale):
+    definition = EMAIL_TEMPLATES[name]
+    strings = definition['strings'][locale]
+    html_strings = {key: escape(value) for key, value in strings.items()}
+
+    html = _LAYOUT % dict(
+        html_strings,
+        lang=locale,
+        style=_STYLE,
+        body=definition['html'] % html_strings,
+    )
+    text = definition['text'] % strings
+    return EmailTemplate(strings['subject'], html, text)
+
+
+def get_email_template(name, locale=None):
+    return _compile(name, resolve_locale(name, locale))
@@ -0,0 +1,282 @@
+import asyncio
+import re
+import threading
+import time
+import weakref
+from functools import lru_cache
+
+import jwt
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .metrics import timed
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+GOOGLE_TOKEN_URI = 'https://oauth2.googleapis.com/token'
+GOOGLE_CERTS_URI = 'https://www.googleapis.com/oauth2/v3/certs'
+GOOGLE_USERINFO_URI = 'https://www.googleapis.com/oauth2/v1/userinfo'
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+class GoogleOAuthError(Exception):
+    pass
+
+
+class GoogleOAuthClient:
+    """Keep-alive HTTP client for the Google authorization code flow.
+
+    The ``id_token`` returned with the access token is verified locally
+    against Google's signing keys, which are cached for as long as the certs
+    endpoint's ``Cache-Control: max-age`` allows. The userinfo endpoint is
+    only called when no verifiable ``id_token`` is available.
+    """
+
+    MIN_REFRESH_INTERVAL = 60
+
+    def __init__(self, client_id, client_secret, redirect_uri, token_uri=GOOGLE_TOKEN_URI,
+                 certs_uri=GOOGLE_CERTS_URI, userinfo_uri=GOOGLE_USERINFO_URI,
+                 timeout=(3.05, 10), pool_size=10, leeway=30):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.redirect_uri = redirect_uri
+        self.token_uri = token_uri
+        self.certs_uri = certs_uri
+        self.userinfo_uri = userinfo_uri
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.leeway = leeway
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._keys = {}
+        self._keys_fetched_at = float('-inf')
+        self._keys_expire_at = 0.0
+        self._keys_lock = threading.Lock()
+
+    def _request(self, method, url, **kwargs):
+        try:
+            with timed('oauth_http', url=url):
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            response.raise_for_status()
+            return response
+        except requests.Timeout:
+            raise GoogleOAuthError("Google did not respond in time.")
+        except requests.RequestException:
+            raise GoogleOAuthError("Failed to reach Google.")
+
+    def token_request_data(self, code):
+        return {
+            'code': code,
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'redirect_uri': self.redirect_uri,
+            'grant_type': 'authorization_code'
+        }
+
+    def exchange_code(self, code):
+        try:
+            token_json = self._request('POST', self.token_uri, data=self.token_request_data(code)).json()
+        except (GoogleOAuthError, ValueError):
+            raise GoogleOAuthError("Failed to obtain access token.")
+
+        if not token_json.get('access_token'):
+            raise GoogleOAuthError("Failed to obtain access token.")
+        return token_json
+
+    def _keys_are_fresh(self, force_refresh):
+        now = time.monotonic()
+        if force_refresh:
+            # Don't let tokens with unknown key ids hammer the certs endpoint
+            return now - self._keys_fetched_at < self.MIN_REFRESH_INTERVAL
+        return now < self._keys_expire_at
+
+    def get_signing_keys(self, force_refresh=False):
+        if self._keys_are_fresh(force_refresh):
+            return self._keys
+
+        with self._keys_lock:
+            # Another thread may have refreshed the keys while we waited
+            if self._keys_are_fresh(force_refresh):
+                return self._keys
+
+            response = self._request('GET', self.certs_uri)
+            return self.store_signing_keys(response.json(), response.headers.get('Cache-Control', ''))
+
+    def store_signing_keys(self, jwks, cache_control):
+        keys = {}
+        for jwk in jwks.get('keys', []):
+            try:
+                keys[jwk['kid']] = jwt.PyJWK(jwk).key
+            except (KeyError, jwt.PyJWKError):
+                continue
+
+        match = MAX_AGE_RE.search(cache_control)
+        max_age = int(match.group(1)) if match else 0
+        self._keys = keys
+        self._keys_fetched_at = time.monotonic()
+        self._keys_expire_at = self._keys_fetched_at + max_age
+        return keys
+
+    @staticmethod
+    def key_id(id_token):
+        try:
+            return jwt.get_unverified_header(id_token).get('kid')
+        except jwt.InvalidTokenError:
+            raise GoogleOAuthError("Invalid ID token.")
+
+    def verify_id_token(self, id_token):
+        kid = self.key_id(id_token)
+        keys = self.get_signing_keys()
+        if kid not in keys:
+            # Google rotated its keys before our cached copy expired
+            keys = self.get_signing_keys(force_refresh=True)
+        return self.decode_id_token(id_token, keys.get(kid))
+
+    def decode_id_token(self, id_token, key):
+        if key is None:
+            raise GoogleOAuthError("Invalid ID token.")
+        try:
+            claims = jwt.decode(
+                id_token, key, algorithms=['RS256'],
+                audience=self.client_id, leeway=self.leeway,
+            )
+        except jwt.InvalidTokenError:
+            raise GoogleOAuthError("Invalid ID token.")
+
+        if claims.get('iss') not in GOOGLE_ISSUERS:
+            raise GoogleOAuthError("Invalid ID token.")
+        return claims
+
+    def fetch_userinfo(self, access_token):
+        return self._request('GET', self.userinfo_uri, params={'access_token': access_token}).json()
+
+    def get_user_info(self, code):
+        """Exchange ``code`` and return the profile in the userinfo v1 format."""
+        token_json = self.exchange_code(code)
+        id_token = token_json.get('id_token')
+
+        if not id_token or not jwt.algorithms.has_crypto:
+            # RS256 verification needs the optional `cryptography` package
+            return self.fetch_userinfo(token_json['access_token'])
+
+        return self.profile_from_claims(self.verify_id_token(id_token))
+
+    @staticmethod
+    def profile_from_claims(claims):
+        return {
+            'id': claims.get('sub'),
+            'email': claims.get('email'),
+            'verified_email': claims.get('email_verified', False),
+            'given_name': claims.get('given_name'),
+            'family_name': claims.get('family_name'),
+            'picture': claims.get('picture'),
+        }
+
+
+@lru_cache(maxsize=None)
+def get_google_client():
+    return GoogleOAuthClient(
+        client_id=settings.GOOGLE_CLIENT_ID,
+        client_secret=settings.GOOGLE_CLIENT_SECRET,
+        redirect_uri=settings.GOOGLE_REDIRECT_URI,
+        token_uri=getattr(settings, 'GOOGLE_TOKEN_URI', GOOGLE_TOKEN_URI),
+        certs_uri=getattr(settings, 'GOOGLE_CERTS_URI', GOOGLE_CERTS_URI),
+        userinfo_uri=getattr(settings, 'GOOGLE_USERINFO_URI', GOOGLE_USERINFO_URI),
+        timeout=getattr(settings, 'GOOGLE_OAUTH_TIMEOUT', (3.05, 10)),
+        pool_size=getattr(settings, 'GOOGLE_OAUTH_POOL_SIZE', 10),
+    )
+
+
+class AsyncGoogleOAuthClient:
+    """httpx twin of GoogleOAuthClient for the async views.
+
+    Shares the signing key cache and the token checks of the sync client it
+    wraps; only the HTTP round trips differ.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        timeout = client.timeout if isinstance(client.timeout, tuple) else (client.timeout, client.timeout)
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+            limits=httpx.Limits(max_connections=client.pool_size, max_keepalive_connections=client.pool_size),
+        )
+        self._keys_lock = asyncio.Lock()
+
+    async def _request(self, method, url, **kwargs):
+        try:
+            with timed('oauth_http', url=url):
+                response = await self.http.request(method, url, **kwargs)
+            response.raise_for_status()
+            return response
+        except httpx.TimeoutException:
+            raise GoogleOAuthError("Google did not respond in time.")
+        except httpx.HTTPError:
+            raise GoogleOAuthError("Failed to reach Google.")
+
+    async def exchange_code(self, code):
+        try:
+            response = await self._request('POST', self.client.token_uri, data=self.client.token_request_data(code))
+            token_json = response.json()
+        except (GoogleOAuthError, ValueError):
+            raise GoogleOAuthError("Failed to obtain access token.")
+
+        if not token_json.get('access_token'):
+            raise GoogleOAuthError("Failed to obtain access token.")
+        return token_json
+
+    async def get_signing_keys(self, force_refresh=False):
+        if self.client._keys_are_fresh(force_refresh):
+            return self.client._keys
+
+        async with self._keys_lock:
+            if self.client._keys_are_fresh(force_refresh):
+                return self.client._keys
+            response = await self._request('GET', self.client.certs_uri)
+            return self.client.store_signing_keys(response.json(), response.headers.get('Cache-Control', ''))
+
+    async def verify_id_token(self, id_token):
+        kid = self.client.key_id(id_token)
+        keys = await self.get_signing_keys()
+        if kid not in keys:
+            keys = await self.get_signing_keys(force_refresh=True)
+        return self.client.decode_id_token(id_token, keys.get(kid))
+
+    async def fetch_userinfo(self, access_token):
+        response = await self._request('GET', self.client.userinfo_uri, params={'access_token': access_token})
+        return response.json()
+
+    async def get_user_info(self, code):
+        token_json = await self.exchange_code(code)
+        id_token = token_json.get('id_token')
+
+        if not id_token or not jwt.algorithms.has_crypto:
+            return await self.fetch_userinfo(token_json['access_token'])
+
+        return self.client.profile_from_claims(await self.verify_id_token(id_token))
+
+
+# httpx pools are bound to the event loop that created them
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_google_client():
+    """The async client for the running loop, or None when httpx isn't installed."""
+    if httpx is None:
+        return None
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.client is not get_google_client():
+        client = _async_clients[loop] = AsyncGoogleOAuthClient(get_google_client())
+    return client
+
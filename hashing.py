@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, is_password_usable, make_password
+from django.utils.module_loading import import_string
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .metrics import observe
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _("Too many password checks in progress, try again shortly.")
+    default_code = 'hashing_busy'
+
+
+def _hash(raw_password):
+    return make_password(raw_password)
+
+
+def _verify(raw_password, encoded):
+    # check_password only calls the setter when the hash should be upgraded
+    must_update = []
+    valid = check_password(raw_password, encoded, setter=must_update.append)
+    return valid, bool(must_update)
+
+
+def _timed_call(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class InlineHashingService:
+    """Hashes in the calling thread, Django's default behaviour."""
+
+    def hash(self, raw_password):
+        result, compute = _timed_call(_hash, raw_password)
+        observe('password_hash', compute)
+        return result
+
+    def hash_many(self, raw_passwords):
+        """Hash a batch, ``None`` giving an unusable password."""
+        return [self.hash(raw_password) for raw_password in raw_passwords]
+
+    def verify(self, raw_password, encoded):
+        """Return ``(valid, must_update)``."""
+        result, compute = _timed_call(_verify, raw_password, encoded)
+        observe('password_verify', compute)
+        return result
+
+
+class ProcessPoolHashingService(InlineHashingService):
+    """Runs PBKDF2 & co. in worker processes so hashing scales with cores.
+
+    At most ``max_pending`` hashes are queued or running; further callers
+    wait up to ``queue_timeout`` seconds for a slot and then get HashingBusy
+    (503) instead of piling up behind the pool. Time spent waiting is
+    reported as ``password_queue_wait``, apart from the compute time.
+    """
+
+    def __init__(self, workers=None, max_pending=None, queue_timeout=None):
+        self.workers = workers or getattr(settings, 'ACCOUNTS_HASHING_WORKERS', None) or os.cpu_count() or 1
+        self.max_pending = max_pending or getattr(settings, 'ACCOUNTS_HASHING_MAX_PENDING', self.workers * 4)
+        self.queue_timeout = queue_timeout if queue_timeout is not None else getattr(settings, 'ACCOUNTS_HASHING_QUEUE_TIMEOUT', 5)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    @property
+    def executor(self):
+        # Created on first use and again after a fork, pools don't survive one
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=django.setup)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _submit(self, func, *args):
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            observe('password_queue_wait', time.perf_counter() - start)
+            raise HashingBusy()
+        try:
+            future = self.executor.submit(_timed_call, func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is held until the worker is done, even if nobody waits for it
+        future.add_done_callback(lambda _: self._slots.release())
+        return start, future
+
+    def _result(self, phase, submitted):
+        start, future = submitted
+        result, compute = future.result()
+        observe('password_queue_wait', time.perf_counter() - start - compute)
+        observe(phase, compute)
+        return result
+
+    def _run(self, phase, func, *args):
+        return self._result(phase, self._submit(func, *args))
+
+    def hash(self, raw_password):
+        if raw_password is None:
+            # Unusable passwords are a random string, not worth a round trip
+            return make_password(None)
+        return self._run('password_hash', _hash, raw_password)
+
+    def hash_many(self, raw_passwords):
+        """Hash a batch across the workers, within the same ``max_pending`` bound."""
+        submitted = []
+        try:
+            for raw_password in raw_passwords:
+                submitted.append(None if raw_password is None else self._submit(_hash, raw_password))
+        except HashingBusy:
+            for entry in filter(None, submitted):
+                entry[1].cancel()
+            raise
+        return [make_password(None) if entry is None else self._result('password_hash', entry) for entry in submitted]
+
+    def verify(self, raw_password, encoded):
+        if raw_password is None or not is_password_usable(encoded):
+            return False, False
+        return self._run('password_verify', _verify, raw_password, encoded)
+
+
+@lru_cache(maxsize=None)
+def get_hashing_service():
+    return import_string(getattr(settings, 'ACCOUNTS_HASHING_SERVICE', 'accounts.hashing.InlineHashingService'))()
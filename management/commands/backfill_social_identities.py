@@ -0,0 +1,86 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from accounts.models import CustomUserModel, SocialIdentity
+
+# Columns that moved from the user table to SocialIdentity, under the same names
+MOVED_COLUMNS = ['google_id', 'picture_url', 'picture', 'picture_etag', 'picture_last_modified']
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy Google ids and pictures from the legacy user columns into SocialIdentity. "
+        "Run between the expand and contract migrations; safe to run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="User ids scanned per transaction.")
+        parser.add_argument('--sleep', type=float, default=0.1, help="Seconds to pause between batches.")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        users = CustomUserModel._meta.db_table
+        with connection.cursor() as cursor:
+            columns = {column.name for column in connection.introspection.get_table_description(cursor, users)}
+            missing = set(MOVED_COLUMNS) - columns
+            if missing:
+                self.stdout.write(f"{users} has no {', '.join(sorted(missing))} column(s), nothing to backfill.")
+                return
+            cursor.execute(f"SELECT MAX({self.q(CustomUserModel._meta.pk.column)}) FROM {self.q(users)}")
+            last_id = cursor.fetchone()[0] or 0
+
+        if options['dry_run']:
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT COUNT(*) {self.candidates_sql()}", [0, last_id])
+                self.stdout.write(f"{cursor.fetchone()[0]} identit(ies) would be copied.")
+            return
+
+        # The models no longer know the legacy columns, hence raw SQL
+        sql = self.insert_sql()
+        copied = batches = 0
+        start = time.perf_counter()
+        for low in range(0, last_id, options['batch_size']):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, [low, low + options['batch_size']])
+                copied += max(cursor.rowcount, 0)
+            batches += 1
+            time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Copied {copied} identit(ies) in {batches} batch(es) in {time.perf_counter() - start:.1f}s. "
+            f"Cached profiles pick them up within ACCOUNTS_USER_CACHE_TTL."
+        ))
+
+    def q(self, name):
+        return connection.ops.quote_name(name)
+
+    def candidates_sql(self):
+        users, identities = self.q(CustomUserModel._meta.db_table), self.q(SocialIdentity._meta.db_table)
+        pk, user_id = self.q(CustomUserModel._meta.pk.column), self.q(SocialIdentity._meta.get_field('user').column)
+        google_id, picture_url, picture = self.q('google_id'), self.q('picture_url'), self.q('picture')
+        return (
+            f"FROM {users} u WHERE u.{pk} > %s AND u.{pk} <= %s "
+            f"AND (u.{google_id} IS NOT NULL OR u.{picture_url} IS NOT NULL "
+            f"OR (u.{picture} IS NOT NULL AND u.{picture} <> '')) "
+            # Rows written since the deploy are newer than the legacy columns
+            f"AND NOT EXISTS (SELECT 1 FROM {identities} s WHERE s.{user_id} = u.{pk})"
+        )
+
+    def insert_sql(self):
+        users, identities = self.q(CustomUserModel._meta.db_table), self.q(SocialIdentity._meta.db_table)
+        pk, user_id = self.q(CustomUserModel._meta.pk.column), self.q(SocialIdentity._meta.get_field('user').column)
+        google_id = self.q('google_id')
+        columns = [self.q(column) for column in MOVED_COLUMNS]
+        # google_id was not unique before: only the oldest account keeps a shared one
+        shared_google_id = (
+            f"EXISTS (SELECT 1 FROM {users} d WHERE d.{google_id} = u.{google_id} AND d.{pk} < u.{pk}) "
+            f"OR EXISTS (SELECT 1 FROM {identities} t WHERE t.{google_id} = u.{google_id})"
+        )
+        return (
+            f"INSERT INTO {identities} ({user_id}, {', '.join(columns)}) "
+            f"SELECT u.{pk}, CASE WHEN {shared_google_id} THEN NULL ELSE u.{google_id} END, "
+            f"{', '.join(f'u.{column}' for column in columns[1:])} "
+            f"{self.candidates_sql()}"
+        )
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.html import strip_tags
+
+from accounts.email_templates import get_email_template
+
+
+class Command(BaseCommand):
+    help = "Compare per-message render cost of the email templates before and after precompilation."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000)
+        parser.add_argument('--locale', default='en')
+
+    def _bench(self, label, render, iterations):
+        start = time.perf_counter()
+        for i in range(iterations):
+            render(i)
+        per_message = (time.perf_counter() - start) / iterations
+        self.stdout.write(f"{label:<40} {per_message * 1e6:10.1f} us/message")
+        return per_message
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        template = get_email_template('activation', options['locale'])
+
+        def context(i):
+            otp_code = f'{i % 100000:05d}'
+            return {
+                'otp_code': otp_code,
+                'activation_link': f'https://example.com/api/activate/?otp={otp_code}&email=user{i}@example.com',
+            }
+
+        # Before: the full document was formatted per call and the text part
+        # was derived with strip_tags.
+        def legacy(i):
+            html_content = template.html.render(context(i))
+            return strip_tags(html_content), html_content
+
+        def compiled(i):
+            return template.render(**context(i))
+
+        before = self._bench("f-string + strip_tags (before)", legacy, iterations)
+        after = self._bench("precompiled template (after)", compiled, iterations)
+        self.stdout.write(f"Speedup: {before / after:.1f}x")
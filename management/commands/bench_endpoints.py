@@ -0,0 +1,451 @@
+import abc
+import asyncio
+import json
+import os
+import statistics
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from unittest import mock
+
+import jwt
+from asgiref.sync import async_to_sync
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.tokens import default_token_generator
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from accounts.google_oauth import AsyncGoogleOAuthClient, GoogleOAuthClient, get_google_client
+from accounts.hashing import get_hashing_service
+from accounts.models import CustomUserModel
+from accounts.otp import issue_otps
+from accounts.profiles import current_profile_etag
+from accounts.revocation import get_revocation_map
+from accounts.throttling import get_limiter
+
+PASSWORD = 'bench-password'
+# Reference numbers committed with the app, recorded with --fast-hasher
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'bench_baseline.json')
+METRICS_TOKEN = 'bench-metrics-token'
+
+
+class Scenario(abc.ABC):
+    """One endpoint: ``prepare(n)`` builds fixtures, ``request(i)`` returns the call arguments."""
+
+    method = 'post'
+    expected_status = 200
+    # Accounts handled per request, for the rows/s column
+    rows = 1
+
+    def __init__(self, name):
+        self.name = name
+
+    def prepare(self, n):
+        pass
+
+    @abc.abstractmethod
+    def request(self, i):
+        """Return ``(url, data, extra)`` for the i-th call."""
+
+
+def create_users(prefix, n, **fields):
+    fields.setdefault('is_active', True)
+    password = make_password(PASSWORD)
+    return CustomUserModel.objects.bulk_create([
+        CustomUserModel(email=f'{prefix}{i}@bench.example.com', first_name='Bench', password=password, **fields)
+        for i in range(n)
+    ])
+
+
+def auth_header(user):
+    # headers= rather than HTTP_* extras, which AsyncClient puts in the ASGI scope
+    return {'headers': {'Authorization': f'Bearer {AccessToken.for_user(user)}'}}
+
+
+class Register(Scenario):
+    expected_status = 201
+
+    def request(self, i):
+        return reverse('user-register'), {'email': f'register{i}@bench.example.com', 'first_name': 'Bench', 'password': PASSWORD}, {}
+
+
+class RegisterBulk(Scenario):
+    expected_status = 201
+    rows = 100
+
+    def prepare(self, n):
+        self.headers = auth_header(create_users('staff', 1, is_staff=True)[0])
+
+    def request(self, i):
+        users = [
+            {'email': f'bulk{i}-{j}@bench.example.com', 'first_name': 'Bench', 'password': PASSWORD}
+            for j in range(self.rows)
+        ]
+        return reverse('user-register-bulk'), {'users': users}, self.headers
+
+
+class Activate(Scenario):
+    def prepare(self, n):
+        users = create_users('activate', n, is_active=False)
+        self.codes = issue_otps([user.email for user in users])
+        self.emails = [user.email for user in users]
+
+    def request(self, i):
+        email = self.emails[i]
+        return reverse('activate-account'), {'email': email, 'otp': self.codes[email]}, {}
+
+
+class Validate(Scenario):
+    expected_status = 201
+
+    def prepare(self, n):
+        self.emails = [user.email for user in create_users('validate', n, is_active=False)]
+
+    def request(self, i):
+        return reverse('email-validate'), {'email': self.emails[i]}, {}
+
+
+class Login(Scenario):
+    def prepare(self, n):
+        self.user = create_users('login', 1)[0]
+
+    def request(self, i):
+        return reverse('login'), {'email': self.user.email, 'password': PASSWORD}, {}
+
+
+class GoogleLogin(Scenario):
+    def request(self, i):
+        return reverse('google-login'), {'code': f'code-{i % 10}'}, {}
+
+
+class Profile(Scenario):
+    method = 'get'
+
+    def __init__(self, name, conditional=False):
+        super().__init__(name)
+        self.conditional = conditional
+        self.expected_status = 304 if conditional else 200
+
+    def prepare(self, n):
+        user = create_users('etag' if self.conditional else 'profile', 1)[0]
+        self.headers = auth_header(user)
+        if self.conditional:
+            self.headers['headers']['If-None-Match'] = current_profile_etag(user.pk)
+
+    def request(self, i):
+        return reverse('me'), {}, self.headers
+
+
+class TokenRefresh(Scenario):
+    def prepare(self, n):
+        # Rotation may blacklist each refresh token after use, so one token per request
+        user = create_users('refresh', 1)[0]
+        self.tokens = [str(RefreshToken.for_user(user)) for _ in range(n)]
+
+    def request(self, i):
+        return reverse('token-refresh'), {'refresh': self.tokens[i]}, {}
+
+
+class Metrics(Scenario):
+    method = 'get'
+
+    def request(self, i):
+        return reverse('metrics'), {}, {'headers': {'Authorization': f'Bearer {METRICS_TOKEN}'}}
+
+
+class ChangePassword(Scenario):
+    method = 'put'
+
+    def prepare(self, n):
+        # A password change revokes the caller's tokens, so one user per request
+        self.headers = [auth_header(user) for user in create_users('change', n)]
+
+    def request(self, i):
+        return reverse('change-password'), {'old_password': PASSWORD, 'new_password': PASSWORD}, self.headers[i]
+
+
+class SetPassword(Scenario):
+    method = 'put'
+
+    def prepare(self, n):
+        self.headers = [auth_header(user) for user in create_users('set', n)]
+
+    def request(self, i):
+        return reverse('set-password'), {'new_password': PASSWORD}, self.headers[i]
+
+
+class PasswordReset(Scenario):
+    def prepare(self, n):
+        self.user = create_users('reset', 1)[0]
+
+    def request(self, i):
+        return reverse('password-reset'), {'email': self.user.email}, {}
+
+
+class PasswordResetConfirm(Scenario):
+    method = 'put'
+
+    def prepare(self, n):
+        # A token is only valid until the password changes, so one user per request
+        create_users('confirm', n)
+        self.urls = [
+            reverse('password-reset-confirm', kwargs={
+                'uidb64': urlsafe_base64_encode(force_bytes(user.pk)),
+                'token': default_token_generator.make_token(user),
+            })
+            for user in CustomUserModel.objects.filter(email__startswith='confirm').order_by('pk')
+        ]
+
+    def request(self, i):
+        return self.urls[i], {'new_password': PASSWORD}, {}
+
+
+SCENARIOS = [
+    Register('register/'),
+    RegisterBulk('register/bulk/'),
+    Activate('activate/'),
+    Validate('validate/'),
+    Login('login/'),
+    GoogleLogin('google-login/'),
+    Profile('me/'),
+    Profile('me/ (304)', conditional=True),
+    ChangePassword('change-password/'),
+    SetPassword('set-password/'),
+    PasswordReset('password-reset/'),
+    PasswordResetConfirm('password-reset/confirm/'),
+    TokenRefresh('token/refresh/'),
+    Metrics('metrics/'),
+]
+
+
+class StubGoogle:
+    """Answers the token exchange locally with an id_token signed by a throwaway key."""
+
+    def __init__(self):
+        from cryptography.hazmat.primitives.asymmetric import rsa
+
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    def exchange_code(self, client, code):
+        now = int(time.time())
+        id_token = jwt.encode({
+            'iss': 'https://accounts.google.com', 'aud': client.client_id, 'sub': code,
+            'email': f'{code}@bench.example.com', 'email_verified': True,
+            'given_name': 'Bench', 'family_name': 'Google', 'iat': now, 'exp': now + 3600,
+        }, self.private_key, algorithm='RS256', headers={'kid': 'bench'})
+        return {'access_token': 'bench-access-token', 'id_token': id_token}
+
+    def install(self):
+        client = get_google_client()
+        client._keys = {'bench': self.private_key.public_key()}
+        client._keys_expire_at = float('inf')
+        stub = self
+
+        def exchange_code(self, code):
+            return stub.exchange_code(self, code)
+
+        async def aexchange_code(self, code):
+            return stub.exchange_code(self.client, code)
+
+        patches = ExitStack()
+        patches.enter_context(mock.patch.object(GoogleOAuthClient, 'exchange_code', exchange_code))
+        patches.enter_context(mock.patch.object(AsyncGoogleOAuthClient, 'exchange_code', aexchange_code))
+        return patches
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = "Benchmark every accounts endpoint in-process against a throwaway test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help="Requests per endpoint.")
+        parser.add_argument('--concurrency', type=int, default=1, help="Number of clients sending requests at once.")
+        parser.add_argument('--alloc-samples', type=int, default=5, help="Extra requests per endpoint traced with tracemalloc.")
+        parser.add_argument('--only', nargs='*', help="Endpoints to run, e.g. login/ register/.")
+        parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE,
+                            help="Write the results to this JSON file (the committed bench_baseline.json without a path).")
+        parser.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE,
+                            help="Baseline JSON file to compare against (the committed bench_baseline.json without a path).")
+        parser.add_argument('--threshold', type=float, default=0.25, help="Allowed relative regression (0.25 = 25%%).")
+        parser.add_argument('--fast-hasher', action='store_true', help="Use MD5 password hashing to focus on everything else.")
+        parser.add_argument('--process-hashing', action='store_true',
+                            help="Hash passwords with ProcessPoolHashingService (workers ignore --fast-hasher).")
+        parser.add_argument('--async', action='store_true', dest='async_views',
+                            help="Serve accounts.async_urls and keep --concurrency requests in flight on one event loop.")
+
+    def handle(self, *args, **options):
+        scenarios = [s for s in SCENARIOS if not options['only'] or s.name in options['only']]
+        overrides = {
+            'EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend',
+            'ACCOUNTS_THROTTLE_EMAIL_LIMIT': 10 ** 9,
+            'ACCOUNTS_THROTTLE_IP_LIMIT': 10 ** 9,
+            'ACCOUNTS_METRICS_TOKEN': METRICS_TOKEN,
+        }
+        if options['fast_hasher']:
+            overrides['PASSWORD_HASHERS'] = ['django.contrib.auth.hashers.MD5PasswordHasher']
+        if options['async_views']:
+            overrides['ROOT_URLCONF'] = 'accounts.async_urls'
+        if options['process_hashing']:
+            overrides['ACCOUNTS_HASHING_SERVICE'] = 'accounts.hashing.ProcessPoolHashingService'
+
+        if options['concurrency'] > 1 and connection.vendor == 'sqlite' and not options['async_views']:
+            self.stderr.write("SQLite serializes writers: endpoints that write may fail with "
+                              "'database is locked' under --concurrency. Use PostgreSQL or MySQL.")
+
+        setup_test_environment()
+        get_limiter.cache_clear()
+        get_hashing_service.cache_clear()
+        get_revocation_map.cache_clear()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(**overrides), StubGoogle().install():
+                results = {scenario.name: self.run_scenario(scenario, options) for scenario in scenarios}
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            get_hashing_service.cache_clear()
+
+        self.report(results)
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as fh:
+                json.dump(results, fh, indent=2, sort_keys=True)
+                fh.write('\n')
+        if options['compare']:
+            self.compare(results, options['compare'], options['threshold'])
+
+    def call(self, client, scenario, i):
+        url, data, headers = scenario.request(i)
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(client, scenario.method)(url, data, content_type='application/json', **headers)
+            elapsed = time.perf_counter() - start
+        if response.status_code != scenario.expected_status:
+            raise CommandError(f"{scenario.name} returned {response.status_code}: {response.content[:200]!r}")
+        return elapsed, len(queries)
+
+    async def acall(self, client, scenario, i):
+        url, data, headers = scenario.request(i)
+        start = time.perf_counter()
+        response = await getattr(client, scenario.method)(url, data, content_type='application/json', **headers)
+        elapsed = time.perf_counter() - start
+        if response.status_code != scenario.expected_status:
+            raise CommandError(f"{scenario.name} returned {response.status_code}: {response.content[:200]!r}")
+        return elapsed
+
+    async def run_async(self, scenario, n, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(i):
+            async with semaphore:
+                return await self.acall(client, scenario, i)
+
+        return await asyncio.gather(*(one(i) for i in range(n)))
+
+    def run_scenario_async(self, scenario, n, concurrency):
+        # Run from this thread so the views' sync_to_async calls share its connection
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            latencies = async_to_sync(self.run_async)(scenario, n, concurrency)
+        # Concurrent requests interleave, so only the average is known
+        return [(elapsed, queries / n) for elapsed in latencies]
+
+    def run_scenario(self, scenario, options):
+        n = options['requests']
+        samples = options['alloc_samples']
+        scenario.prepare(n + samples)
+
+        local = threading.local()
+
+        def worker(i):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            return self.call(local.client, scenario, i)
+
+        start = time.perf_counter()
+        if options['async_views']:
+            measurements = self.run_scenario_async(scenario, n, options['concurrency'])
+        elif options['concurrency'] > 1:
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                measurements = list(pool.map(worker, range(n)))
+        else:
+            measurements = [worker(i) for i in range(n)]
+        wall = time.perf_counter() - start
+
+        # Allocation tracing slows requests down, so it runs on separate samples
+        peaks = []
+        client = AsyncClient() if options['async_views'] else Client()
+        tracemalloc.start()
+        try:
+            for i in range(n, n + samples):
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+                if options['async_views']:
+                    async_to_sync(self.acall)(client, scenario, i)
+                else:
+                    self.call(client, scenario, i)
+                peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        finally:
+            tracemalloc.stop()
+
+        latencies = [elapsed * 1000 for elapsed, _ in measurements]
+        return {
+            'requests': n,
+            'concurrency': options['concurrency'],
+            'p50_ms': statistics.median(latencies),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'rps': n / wall,
+            'rows_per_s': n * scenario.rows / wall,
+            'queries': statistics.mean(queries for _, queries in measurements),
+            'alloc_kib': statistics.median(peaks) / 1024 if peaks else 0,
+        }
+
+    def report(self, results):
+        self.stdout.write(f"{'endpoint':<26}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}{'rows/s':>9}{'queries':>9}{'alloc KiB':>11}")
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<26}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}"
+                f"{result['rps']:>9.1f}{result['rows_per_s']:>9.1f}{result['queries']:>9.1f}{result['alloc_kib']:>11.1f}"
+            )
+
+    def compare(self, results, path, threshold):
+        with open(path) as fh:
+            baseline = json.load(fh)
+
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if not before:
+                continue
+            if before.get('concurrency') != result['concurrency']:
+                self.stderr.write(f"{name}: baseline was recorded with concurrency {before.get('concurrency')}.")
+            for metric in ('p50_ms', 'p95_ms'):
+                if result[metric] > before[metric] * (1 + threshold):
+                    regressions.append(f"{name} {metric}: {before[metric]:.2f} -> {result[metric]:.2f}")
+            if result['queries'] > before['queries']:
+                regressions.append(f"{name} queries: {before['queries']:.1f} -> {result['queries']:.1f}")
+
+        if regressions:
+            raise CommandError("Performance regressions:\n  " + "\n  ".join(regressions))
+        self.stdout.write(self.style.SUCCESS(f"No regression beyond {threshold:.0%} against {path}."))
@@ -0,0 +1,35 @@
+import time
+
+from django.contrib.auth.hashers import check_password, get_hasher, make_password
+from django.core.management.base import BaseCommand
+
+from accounts.throttling import SlidingWindowLimiter
+
+
+class Command(BaseCommand):
+    help = "Compare the cost of a login throttle check with one password hash."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=10000)
+        parser.add_argument('--hash-iterations', type=int, default=20)
+        parser.add_argument('--cache', default='default', help="Cache alias the limiter should use.")
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        limiter = SlidingWindowLimiter('bench', limit=iterations * 2, window=300, lockout=900, cache_alias=options['cache'])
+
+        start = time.perf_counter()
+        for i in range(iterations):
+            limiter.hit(f'user{i % 1000}@example.com')
+        throttle_cost = (time.perf_counter() - start) / iterations
+
+        encoded = make_password('securepassword')
+        algorithm = get_hasher().algorithm
+        start = time.perf_counter()
+        for _ in range(options['hash_iterations']):
+            check_password('securepassword', encoded)
+        hash_cost = (time.perf_counter() - start) / options['hash_iterations']
+
+        self.stdout.write(f"throttle check         {throttle_cost * 1e6:10.1f} us")
+        self.stdout.write(f"{algorithm + ' verify':<22} {hash_cost * 1e6:10.1f} us")
+        self.stdout.write(f"One hash costs as much as {hash_cost / throttle_cost:.1f} throttle checks")
@@ -0,0 +1,98 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Lower, Trim
+
+from accounts.models import CustomUserModel, OTPCode
+from accounts.user_cache import invalidate_user
+
+ARCHIVE_FIELDS = ['id', 'email', 'first_name', 'last_name', 'date_joined', 'is_active', 'last_login']
+
+
+def canonical(queryset):
+    return queryset.annotate(canonical=Lower(Trim('email')))
+
+
+def survivor_key(user):
+    # Prefer the account people actually use, then the oldest one
+    return (not user.is_active, not user.verified_email, -(user.last_login.timestamp() if user.last_login else 0), user.pk)
+
+
+class Command(BaseCommand):
+    help = "Resolve accounts whose emails differ only by case, then store every email in canonical form."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows updated per transaction.")
+        parser.add_argument('--delete', action='store_true',
+                            help="Delete the duplicates instead of deactivating and renaming them.")
+        parser.add_argument('--archive', help="Append the duplicates to this JSONL file first.")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        groups = list(
+            canonical(CustomUserModel.objects).values('canonical')
+            .annotate(n=Count('id')).filter(n__gt=1).values_list('canonical', flat=True)
+        )
+        archive = open(options['archive'], 'a', encoding='utf-8') if options['archive'] else None
+        duplicates = 0
+        try:
+            for start in range(0, len(groups), options['batch_size']):
+                duplicates += self.resolve(groups[start:start + options['batch_size']], archive, options)
+        finally:
+            if archive:
+                archive.close()
+
+        if options['dry_run']:
+            self.stdout.write(f"{len(groups)} colliding email(s), {duplicates} duplicate account(s) would be resolved.")
+            return
+
+        normalized = self.normalize(options['batch_size'])
+        # Codes are hashed with the address they were sent to, stale ones can't match anymore
+        otps, _ = canonical(OTPCode.objects).exclude(email=F('canonical')).delete()
+        self.stdout.write(self.style.SUCCESS(
+            f"Resolved {duplicates} duplicate account(s) in {len(groups)} group(s), "
+            f"normalized {normalized} email(s) and dropped {otps} stale OTP(s)."
+        ))
+
+    @transaction.atomic
+    def resolve(self, emails, archive, options):
+        users = {}
+        for user in canonical(CustomUserModel.objects).filter(canonical__in=emails):
+            users.setdefault(user.canonical, []).append(user)
+
+        resolved = 0
+        for email, group in users.items():
+            keep, *duplicates = sorted(group, key=survivor_key)
+            resolved += len(duplicates)
+            self.stdout.write(f"{email}: keeping #{keep.pk}, resolving {', '.join(f'#{u.pk}' for u in duplicates)}")
+            if options['dry_run']:
+                continue
+
+            pks = [user.pk for user in duplicates]
+            if archive:
+                for row in CustomUserModel.objects.filter(pk__in=pks).values(*ARCHIVE_FIELDS):
+                    archive.write(json.dumps(row, default=str) + '\n')
+            if options['delete']:
+                CustomUserModel.objects.filter(pk__in=pks).delete()
+                continue
+            local, _, domain = email.partition('@')
+            for user in duplicates:
+                CustomUserModel.objects.filter(pk=user.pk).update(
+                    email=f'duplicate-{user.pk}+{local}@{domain}', is_active=False,
+                )
+                invalidate_user(user.pk)
+        return resolved
+
+    def normalize(self, batch_size):
+        queryset = canonical(CustomUserModel.objects).exclude(email=F('canonical'))
+        normalized = 0
+        while True:
+            with transaction.atomic():
+                pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+                if not pks:
+                    return normalized
+                normalized += CustomUserModel.objects.filter(pk__in=pks).update(email=Lower(Trim('email')))
+            for pk in pks:
+                invalidate_user(pk)
@@ -0,0 +1,79 @@
+import json
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from accounts.models import CustomUserModel, OTPCode
+from accounts.otp import otp_retention, purge_expired_otps
+
+ARCHIVE_FIELDS = ['id', 'email', 'first_name', 'last_name', 'date_joined']
+
+
+class Command(BaseCommand):
+    help = "Delete accounts that were never activated and whose OTP expired more than N days ago."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help="Grace period after the last OTP expired.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Accounts deleted per transaction.")
+        parser.add_argument('--sleep', type=float, default=0.1, help="Seconds to pause between batches.")
+        parser.add_argument('--archive', help="Append the deleted accounts to this JSONL file first.")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def get_queryset(self, days):
+        cutoff = timezone.now() - timedelta(days=days)
+        return CustomUserModel.objects.filter(
+            is_active=False,
+            verified_email=False,
+            last_login__isnull=True,
+            date_joined__lt=cutoff,
+        ).exclude(
+            # A code issued by validate/ keeps the account alive for the grace
+            # period after it expires; expired codes are kept ACCOUNTS_OTP_RETENTION
+            Exists(OTPCode.objects.filter(email=OuterRef('email'), expires_at__gte=cutoff))
+        )
+
+    def handle(self, *args, **options):
+        if timedelta(days=options['days']) > otp_retention():
+            self.stderr.write(
+                f"Expired OTPs are only kept for {otp_retention()} (ACCOUNTS_OTP_RETENTION): accounts whose "
+                f"last code expired before that get less than {options['days']} day(s) of grace."
+            )
+        queryset = self.get_queryset(options['days'])
+
+        if options['dry_run']:
+            self.stdout.write(f"{queryset.count()} account(s) would be deleted.")
+            return
+
+        archive = open(options['archive'], 'a', encoding='utf-8') if options['archive'] else None
+        deleted = batches = 0
+        start = time.perf_counter()
+        try:
+            while True:
+                with transaction.atomic():
+                    # Locked so an activation waits for the batch, and filtered again
+                    # on delete so an account that stopped matching is left alone
+                    pks = list(queryset.select_for_update(skip_locked=True).values_list('pk', flat=True)[:options['batch_size']])
+                    if not pks:
+                        break
+                    batch = queryset.filter(pk__in=pks)
+                    if archive:
+                        for row in batch.values(*ARCHIVE_FIELDS):
+                            archive.write(json.dumps(row, default=str) + '\n')
+                    _, per_model = batch.delete()
+
+                deleted += per_model.get(CustomUserModel._meta.label, 0)
+                batches += 1
+                time.sleep(options['sleep'])
+        finally:
+            if archive:
+                archive.close()
+
+        otps = purge_expired_otps(force=True)
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} unverified account(s) in {batches} batch(es) "
+            f"and {otps} expired OTP(s) in {time.perf_counter() - start:.1f}s."
+        ))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.outbox import drain_outbox, queue_depth
+
+
+class Command(BaseCommand):
+    help = "Send pending emails from the outbox in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="Number of emails sent per SMTP connection.")
+        parser.add_argument('--loop', action='store_true', help="Keep draining the outbox instead of exiting once it is empty.")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds to sleep between polls when the outbox is empty (with --loop).")
+        parser.add_argument('--depth', action='store_true', help="Print the number of pending emails and exit.")
+
+    def handle(self, *args, **options):
+        if options['depth']:
+            self.stdout.write(str(queue_depth()))
+            return
+
+        while True:
+            sent, failed = drain_outbox(batch_size=options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f"Sent {sent} email(s), {failed} failed. Queue depth: {queue_depth()}")
+                continue
+
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,174 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import ExitStack, contextmanager, nullcontext
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections
+from django.utils.module_loading import import_string
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current_view = contextvars.ContextVar('accounts_current_view', default='')
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count', 'lock')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(BUCKETS, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def observe(phase, seconds, view=None):
+    key = (phase, _current_view.get() if view is None else view)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(key, Histogram())
+    histogram.observe(seconds)
+
+
+@lru_cache(maxsize=None)
+def get_tracer():
+    """Optional ``ACCOUNTS_METRICS_TRACER``: a callable ``(name, attributes)`` returning a context manager."""
+    path = getattr(settings, 'ACCOUNTS_METRICS_TRACER', None)
+    return import_string(path) if path else None
+
+
+@contextmanager
+def timed(phase, **attributes):
+    tracer = get_tracer()
+    span = tracer(f'accounts.{phase}', dict(attributes, view=_current_view.get())) if tracer else nullcontext()
+    with span:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            observe(phase, time.perf_counter() - start)
+
+
+def _time_query(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        observe('db_query', time.perf_counter() - start)
+
+
+class InstrumentedViewMixin:
+    """Times the whole request and every ORM query it runs, labelled with the view name."""
+
+    def dispatch(self, request, *args, **kwargs):
+        token = _current_view.set(type(self).__name__)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_time_query))
+                with timed('request'):
+                    return super().dispatch(request, *args, **kwargs)
+        finally:
+            _current_view.reset(token)
+
+
+class InstrumentedAsyncViewMixin:
+    """Async counterpart of InstrumentedViewMixin.
+
+    Only the whole request is timed here: the ORM runs in sync_to_async
+    threads whose connections the view can't wrap.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        token = _current_view.set(type(self).__name__)
+        try:
+            with timed('request'):
+                return await super().dispatch(request, *args, **kwargs)
+        finally:
+            _current_view.reset(token)
+
+
+def _format_labels(labels):
+    return ','.join(f'{name}="{value}"' for name, value in labels)
+
+
+def _collect_histograms():
+    lines = [
+        '# HELP accounts_phase_duration_seconds Time spent per request phase.',
+        '# TYPE accounts_phase_duration_seconds histogram',
+    ]
+    with _histograms_lock:
+        items = sorted(_histograms.items())
+    for (phase, view), histogram in items:
+        counts, total, count = histogram.snapshot()
+        labels = [('phase', phase), ('view', view)]
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS + (float('inf'),), counts):
+            cumulative += bucket_count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'accounts_phase_duration_seconds_bucket{{{_format_labels(labels + [("le", le)])}}} {cumulative}')
+        lines.append(f'accounts_phase_duration_seconds_sum{{{_format_labels(labels)}}} {total}')
+        lines.append(f'accounts_phase_duration_seconds_count{{{_format_labels(labels)}}} {count}')
+    return lines
+
+
+def _collect_throttle():
+    from .throttling import throttle_stats
+
+    lines = [
+        '# HELP accounts_throttle_attempts_total Credential attempts seen by the login throttle.',
+        '# TYPE accounts_throttle_attempts_total counter',
+    ]
+    for (scope, outcome), value in sorted(throttle_stats().items()):
+        lines.append(f'accounts_throttle_attempts_total{{{_format_labels([("scope", scope), ("outcome", outcome)])}}} {value}')
+    return lines
+
+
+def _collect_outbox():
+    from .outbox import queue_depth
+
+    return [
+        '# HELP accounts_email_outbox_depth Emails waiting in the outbox.',
+        '# TYPE accounts_email_outbox_depth gauge',
+        f'accounts_email_outbox_depth {queue_depth()}',
+    ]
+
+
+def _collect_coalescing():
+    from .coalescing import coalescing_stats
+
+    lines = [
+        '# HELP accounts_coalesced_requests_total Password reset and OTP resend requests, issued or coalesced.',
+        '# TYPE accounts_coalesced_requests_total counter',
+    ]
+    for (kind, outcome), value in sorted(coalescing_stats().items()):
+        lines.append(f'accounts_coalesced_requests_total{{{_format_labels([("kind", kind), ("outcome", outcome)])}}} {value}')
+    return lines
+
+
+COLLECTORS = [_collect_histograms, _collect_throttle, _collect_outbox, _collect_coalescing]
+
+
+def render_prometheus():
+    lines = []
+    for collector in COLLECTORS:
+        lines.extend(collector())
+    return '\n'.join(lines) + '\n'
@@ -1,8 +1,43 @@
-from django.db import models
+from django.db import connections, models
+from django.db.models.functions import Lower, Upper
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from .hashing import get_hashing_service
+
+class PrefixSearchIndex(models.Index):
+    """B-tree index on an expression that ``LIKE 'prefix%'`` lookups can use.
+
+    Under a collation other than C, PostgreSQL only uses a B-tree for LIKE
+    when it is built with the ``varchar_pattern_ops`` operator class, which
+    no other backend understands; elsewhere this is a plain expression index.
+    """
+
+    def __init__(self, expression, *, name):
+        super().__init__(expression, name=name)
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor == 'postgresql':
+            from django.contrib.postgres.indexes import OpClass
+
+            index = models.Index(*[OpClass(expression, name='varchar_pattern_ops') for expression in self.expressions], name=self.name)
+            return index.create_sql(model, schema_editor, using, **kwargs)
+        return super().create_sql(model, schema_editor, using, **kwargs)
+
 class CustomUserManager(BaseUserManager):
+    @classmethod
+    def normalize_email(cls, email):
+        """Canonical form of an address: stripped and fully lowercased.
+
+        Every lookup uses it, so the unique index on ``email`` serves
+        case-insensitive matches without ``iexact`` scans.
+        """
+        return (email or '').strip().lower()
+
+    def get_by_natural_key(self, username):
+        return self.get(email=self.normalize_email(username))
+
     def create_user(self, email, first_name, password=None, **extra_fields):
         if not email:
             raise ValueError(_('The Email field must be set'))
@@ -17,23 +52,55 @@ class CustomUserManager(BaseUserManager):
         extra_fields.setdefault('is_superuser', True)
         return self.create_user(email, first_name, password, **extra_fields)
 
+    def upsert_google_user(self, email, google_id=None, picture_url=None, **profile):
+        """Create or update the user behind a Google login, writing only what changed.
+
+        A returning user whose profile is unchanged costs one SELECT (joined
+        with their SocialIdentity) and no write. New users are inserted with
+        ``INSERT ... ON CONFLICT (email)`` so concurrent first logins for the
+        same email cannot collide. ``user.social_identity`` is set on return.
+        """
+        from .user_cache import invalidate_user
+
+        email = self.normalize_email(email)
+        user = self.select_related('social_identity').filter(email=email).first()
+        if user is None:
+            features = connections[self.db].features
+            self.bulk_create(
+                [self.model(email=email, is_active=True, **profile)],
+                update_conflicts=True,
+                update_fields=list(profile),
+                # MySQL only supports ON DUPLICATE KEY UPDATE without a target
+                unique_fields=['email'] if features.supports_update_conflicts_with_target else None,
+            )
+            user = self.select_related('social_identity').get(email=email)
+            SocialIdentity.objects.link(user, google_id=google_id, picture_url=picture_url)
+            return user, True
+
+        changed = {field: value for field, value in profile.items() if getattr(user, field) != value}
+        if changed:
+            self.filter(pk=user.pk).update(**changed)
+            for field, value in changed.items():
+                setattr(user, field, value)
+        if SocialIdentity.objects.link(user, google_id=google_id, picture_url=picture_url) or changed:
+            invalidate_user(user.pk)
+        return user, False
+
 class CustomUserModel(AbstractBaseUser, PermissionsMixin):
     email = models.EmailField(_("Email Address"), unique=True, max_length=255)
     first_name = models.CharField(_("First Name"), max_length=100)
     last_name = models.CharField(_("Last Name"), max_length=100, null=True, blank=True)
     is_active = models.BooleanField(default=False)
     is_staff = models.BooleanField(default=False)
-    date_joined = models.DateTimeField(auto_now_add=True)
-    last_login = models.DateTimeField(auto_now=True)
+    # A default rather than auto_now_add, so imports can keep the original date
+    date_joined = models.DateTimeField(default=timezone.now)
+    # Written in bulk by accounts.activity, not on every save
+    last_login = models.DateTimeField(_("Last Login"), null=True, blank=True)
 
-    # New fields
-    google_id = models.CharField(_("Google ID"), max_length=255, blank=True, null=True)
-    picture_url = models.URLField(_("Picture URL"), blank=True, null=True)
-    picture = models.ImageField(_("Picture"), upload_to='user_pictures/', blank=True, null=True)
+    # Google account and picture live in SocialIdentity, off the row every login reads
     verified_email = models.BooleanField(_("Verified Email"), default=False)
-
-    otp_code = models.CharField(_('OTP Code'), max_length=5, null=True, blank=True)
-    otp_generated_at = models.DateTimeField(_('OTP Generated At'), null=True, blank=True)
+    # Bumped to revoke every JWT issued so far, see accounts.revocation
+    token_generation = models.PositiveIntegerField(_("Token Generation"), default=0)
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ['first_name']
@@ -43,6 +110,155 @@ class CustomUserModel(AbstractBaseUser, PermissionsMixin):
     class Meta:
         verbose_name = _("User")
         verbose_name_plural = _("Users")
+        indexes = [
+            # Admin changelist ordering and keyset pagination
+            models.Index(fields=['-date_joined', '-id'], name='accounts_user_joined_idx'),
+            # Case-insensitive prefix search on names in the admin; on PostgreSQL
+            # the unique email column already gets a varchar_pattern_ops index
+            PrefixSearchIndex(Upper('first_name'), name='accounts_user_fname_upper_idx'),
+            PrefixSearchIndex(Upper('last_name'), name='accounts_user_lname_upper_idx'),
+        ]
+        constraints = [
+            # Backstop for writes that bypass normalize_email, e.g. raw updates
+            models.UniqueConstraint(Lower('email'), name='accounts_user_email_ci_unique'),
+        ]
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
+
+    def clean(self):
+        super().clean()
+        self.email = self.__class__.objects.normalize_email(self.email)
+
+    def set_password(self, raw_password):
+        # Hashing goes through the configured service, e.g. a process pool
+        self.password = get_hashing_service().hash(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        valid, must_update = get_hashing_service().verify(raw_password, self.password)
+        if valid and must_update:
+            # Same hasher upgrade as AbstractBaseUser.check_password
+            self.set_password(raw_password)
+            self._password = None
+            self.save(update_fields=['password'])
+        return valid
+
+
+class SocialIdentityManager(models.Manager):
+    def link(self, user, google_id=None, picture_url=None):
+        """Store the Google identity of ``user``, writing only what changed.
+
+        Uses ``user.social_identity`` when it was loaded with the user.
+        Returns True when something was written.
+        """
+        try:
+            identity = user.social_identity
+        except SocialIdentity.DoesNotExist:
+            identity = None
+        fields = {'google_id': google_id, 'picture_url': picture_url}
+        if identity is None and not any(fields.values()):
+            return False
+        changed = {field: value for field, value in fields.items()
+                   if identity is None or getattr(identity, field) != value}
+        if not changed:
+            return False
+
+        if changed.get('google_id'):
+            # A Google account belongs to one user; it moved along with its email
+            self.filter(google_id=changed['google_id']).exclude(pk=user.pk).update(google_id=None)
+        if identity is None:
+            identity = self.model(user=user, **fields)
+            features = connections[self.db].features
+            # Concurrent first logins of the same user update the same row
+            self.bulk_create(
+                [identity],
+                update_conflicts=True,
+                update_fields=list(fields),
+                unique_fields=['user'] if features.supports_update_conflicts_with_target else None,
+            )
+        else:
+            self.filter(pk=user.pk).update(**changed)
+            for field, value in changed.items():
+                setattr(identity, field, value)
+        user.social_identity = identity
+        return True
+
+
+class SocialIdentity(models.Model):
+    """Google account and profile picture of a user.
+
+    Only Google logins, avatar ingestion and the profile read it, so the
+    user row that authentication loads stays narrow.
+    """
+
+    user = models.OneToOneField(CustomUserModel, on_delete=models.CASCADE, primary_key=True,
+                                related_name='social_identity', verbose_name=_("User"))
+    google_id = models.CharField(_("Google ID"), max_length=255, unique=True, blank=True, null=True)
+    picture_url = models.URLField(_("Picture URL"), blank=True, null=True)
+    picture = models.ImageField(_("Picture"), upload_to='user_pictures/', blank=True, null=True)
+    # Validators of the last picture download, for conditional requests
+    picture_etag = models.CharField(_("Picture ETag"), max_length=255, blank=True, null=True)
+    picture_last_modified = models.CharField(_("Picture Last-Modified"), max_length=64, blank=True, null=True)
+
+    objects = SocialIdentityManager()
+
+    class Meta:
+        verbose_name = _("Social Identity")
+        verbose_name_plural = _("Social Identities")
+
+    def __str__(self):
+        return self.google_id or str(self.user_id)
+
+
+class OTPCode(models.Model):
+    email = models.EmailField(_("Email Address"), max_length=255)
+    code_hash = models.CharField(_('Code Hash'), max_length=64)
+    created_at = models.DateTimeField(_('Created At'), auto_now_add=True)
+    expires_at = models.DateTimeField(_('Expires At'), db_index=True)
+
+    class Meta:
+        verbose_name = _("OTP Code")
+        verbose_name_plural = _("OTP Codes")
+        indexes = [
+            models.Index(fields=['email', 'code_hash'], name='accounts_otp_lookup_idx'),
+        ]
+
+    def __str__(self):
+        return self.email
+
+
+class EmailOutbox(models.Model):
+    STATUS_PENDING = 'pending'
+    # Leased by a worker until next_attempt_at, see accounts.outbox
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, _('Pending')),
+        (STATUS_SENDING, _('Sending')),
+        (STATUS_SENT, _('Sent')),
+        (STATUS_FAILED, _('Failed')),
+    )
+
+    subject = models.CharField(_('Subject'), max_length=255)
+    from_email = models.CharField(_('From'), max_length=255, null=True, blank=True)
+    to = models.JSONField(_('To'), default=list)
+    body_text = models.TextField(_('Text Body'))
+    body_html = models.TextField(_('HTML Body'), blank=True)
+    status = models.CharField(_('Status'), max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(_('Attempts'), default=0)
+    next_attempt_at = models.DateTimeField(_('Next Attempt At'), default=timezone.now)
+    last_error = models.TextField(_('Last Error'), blank=True)
+    created_at = models.DateTimeField(_('Created At'), auto_now_add=True)
+    sent_at = models.DateTimeField(_('Sent At'), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("Outgoing Email")
+        verbose_name_plural = _("Outgoing Emails")
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='accounts_outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)}"
@@ -0,0 +1,79 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.crypto import get_random_string, salted_hmac
+
+from .models import OTPCode
+
+OTP_LENGTH = 5
+
+_last_purge = 0.0
+
+
+def _ttl():
+    return getattr(settings, 'ACCOUNTS_OTP_TTL', timedelta(hours=3))
+
+
+def hash_otp(email, code):
+    # Keyed with SECRET_KEY so a leaked table can't be reversed with a 10^5 lookup table
+    return salted_hmac('accounts.otp', f'{email}:{code}', algorithm='sha256').hexdigest()
+
+
+def otp_retention():
+    # Expired codes are kept this long: they tell purge_unverified_accounts
+    # when an account was last sent one, and consume_otp ignores them
+    return getattr(settings, 'ACCOUNTS_OTP_RETENTION', timedelta(days=7))
+
+
+def purge_expired_otps(force=False):
+    """Delete codes expired for longer than ACCOUNTS_OTP_RETENTION.
+
+    Runs at most once per ACCOUNTS_OTP_PURGE_INTERVAL per process.
+    """
+    global _last_purge
+    interval = getattr(settings, 'ACCOUNTS_OTP_PURGE_INTERVAL', 60)
+    if not force and time.monotonic() - _last_purge < interval:
+        return 0
+    _last_purge = time.monotonic()
+    deleted, _ = OTPCode.objects.filter(expires_at__lte=timezone.now() - otp_retention()).delete()
+    return deleted
+
+
+def issue_otp(email):
+    """Generate a new code for ``email``, replacing any outstanding one."""
+    code = get_random_string(length=OTP_LENGTH, allowed_chars='1234567890')
+    OTPCode.objects.filter(email=email).delete()
+    OTPCode.objects.create(email=email, code_hash=hash_otp(email, code), expires_at=timezone.now() + _ttl())
+    purge_expired_otps()
+    return code
+
+
+def issue_otps(emails, batch_size=500):
+    """Bulk variant of issue_otp, returns ``{email: code}``."""
+    codes = {email: get_random_string(length=OTP_LENGTH, allowed_chars='1234567890') for email in emails}
+    expires_at = timezone.now() + _ttl()
+    emails = list(codes)
+    for start in range(0, len(emails), batch_size):
+        OTPCode.objects.filter(email__in=emails[start:start + batch_size]).delete()
+    OTPCode.objects.bulk_create([
+        OTPCode(email=email, code_hash=hash_otp(email, code), expires_at=expires_at)
+        for email, code in codes.items()
+    ], batch_size=batch_size)
+    purge_expired_otps()
+    return codes
+
+
+def consume_otp(email, code):
+    """Check and invalidate a code in a single indexed DELETE.
+
+    Returns True when a live code matched, so two concurrent activations with
+    the same code can't both succeed.
+    """
+    if not email or not code:
+        return False
+    deleted, _ = OTPCode.objects.filter(
+        email=email, code_hash=hash_otp(email, code), expires_at__gt=timezone.now(),
+    ).delete()
+    return deleted > 0
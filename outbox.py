@@ -0,0 +1,147 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .metrics import timed
+from .models import EmailOutbox
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _outbox_entry(message):
+    html_content = ''
+    for content, mimetype in getattr(message, 'alternatives', ()):
+        if mimetype == 'text/html':
+            html_content = content
+            break
+
+    return EmailOutbox(
+        subject=message.subject,
+        from_email=message.from_email,
+        to=list(message.to),
+        body_text=message.body,
+        body_html=html_content,
+    )
+
+
+def queue_email(message):
+    """Persist an EmailMessage in the outbox instead of sending it inline.
+
+    Call this inside the request transaction: the row is committed together
+    with the data the email is about, and the worker picks it up afterwards.
+    """
+    entry = _outbox_entry(message)
+    entry.save()
+    return entry
+
+
+def queue_emails(messages, batch_size=500):
+    """Bulk variant of queue_email, one INSERT per ``batch_size`` messages."""
+    return EmailOutbox.objects.bulk_create([_outbox_entry(message) for message in messages], batch_size=batch_size)
+
+
+def queue_depth():
+    return EmailOutbox.objects.filter(status__in=[EmailOutbox.STATUS_PENDING, EmailOutbox.STATUS_SENDING]).count()
+
+
+def _build_message(entry, connection):
+    message = EmailMultiAlternatives(
+        entry.subject, entry.body_text,
+        from_email=entry.from_email, to=entry.to, connection=connection,
+    )
+    if entry.body_html:
+        message.attach_alternative(entry.body_html, "text/html")
+    return message
+
+
+def _schedule_retry(entry, error, now):
+    entry.attempts += 1
+    entry.last_error = str(error)
+    if entry.attempts >= _setting('ACCOUNTS_OUTBOX_MAX_ATTEMPTS', 5):
+        entry.status = EmailOutbox.STATUS_FAILED
+        return
+
+    # Exponential backoff: 30s, 60s, 120s, ... capped
+    backoff = _setting('ACCOUNTS_OUTBOX_RETRY_BACKOFF', 30) * 2 ** (entry.attempts - 1)
+    backoff = min(backoff, _setting('ACCOUNTS_OUTBOX_MAX_BACKOFF', 3600))
+    entry.status = EmailOutbox.STATUS_PENDING
+    entry.next_attempt_at = now + timedelta(seconds=backoff)
+
+
+def _claim_batch(batch_size, now):
+    """Lease due rows to this worker and commit, so no lock is held while sending.
+
+    Rows stay ``sending`` until their lease (``next_attempt_at``) runs out;
+    those of a worker that died mid-batch are then claimed again.
+    """
+    lease = now + timedelta(seconds=_setting('ACCOUNTS_OUTBOX_LEASE', 300))
+    with transaction.atomic():
+        batch = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status__in=[EmailOutbox.STATUS_PENDING, EmailOutbox.STATUS_SENDING], next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        EmailOutbox.objects.filter(pk__in=[entry.pk for entry in batch]).update(
+            status=EmailOutbox.STATUS_SENDING, next_attempt_at=lease,
+        )
+    return batch
+
+
+def _record(entry):
+    # Only while we still hold the lease, another worker may have taken over
+    EmailOutbox.objects.filter(pk=entry.pk, status=EmailOutbox.STATUS_SENDING).update(
+        status=entry.status, attempts=entry.attempts, next_attempt_at=entry.next_attempt_at,
+        last_error=entry.last_error, sent_at=entry.sent_at,
+    )
+
+
+def drain_outbox(batch_size=None, connection=None):
+    """Send one batch of due emails over a single backend connection.
+
+    Returns a ``(sent, failed)`` tuple. Rows are leased with ``SKIP LOCKED``
+    where the database supports it, so several workers can drain the same
+    outbox concurrently, and each row's outcome is committed right after its
+    send: a crash mid-batch never resends mail that already went out.
+    """
+    batch_size = batch_size or _setting('ACCOUNTS_OUTBOX_BATCH_SIZE', 100)
+    now = timezone.now()
+    sent = failed = 0
+
+    batch = _claim_batch(batch_size, now)
+    if not batch:
+        return sent, failed
+
+    connection = connection or get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as exc:
+        # The relay is unreachable, retry the whole batch later
+        for entry in batch:
+            _schedule_retry(entry, exc, now)
+            _record(entry)
+        return sent, len(batch)
+
+    try:
+        for entry in batch:
+            try:
+                with timed('email_send'):
+                    connection.send_messages([_build_message(entry, connection)])
+            except Exception as exc:
+                _schedule_retry(entry, exc, now)
+                failed += 1
+            else:
+                entry.status = EmailOutbox.STATUS_SENT
+                entry.sent_at = timezone.now()
+                entry.attempts += 1
+                entry.last_error = ''
+                sent += 1
+            _record(entry)
+    finally:
+        connection.close()
+
+    return sent, failed
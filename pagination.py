@@ -0,0 +1,81 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+def estimated_row_count(model, using='default'):
+    """Planner estimate of the table size, or None when the backend has none."""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s",
+                [table],
+            )
+        else:
+            return None
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None and row[0] >= 0 else None
+
+
+class KeysetPaginator(Paginator):
+    """Paginator for very large changelists.
+
+    ``count`` uses the planner's row estimate for unfiltered querysets and a
+    capped ``COUNT`` otherwise. When moving to the next page, the last key of
+    the previous page is looked up in the cache and the page is fetched with
+    a ``WHERE (date_joined, pk) < key`` seek instead of an ``OFFSET`` scan.
+    Random jumps fall back to ``OFFSET``.
+    """
+
+    keyset_ordering = ('-date_joined', '-pk')
+    boundary_timeout = 600
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.has_filters():
+            threshold = getattr(settings, 'ACCOUNTS_ADMIN_ESTIMATE_THRESHOLD', 100000)
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= threshold:
+                return estimate
+        # Never count more rows than the deepest page anybody will open
+        return queryset.all()[:getattr(settings, 'ACCOUNTS_ADMIN_COUNT_LIMIT', 10000)].count()
+
+    @cached_property
+    def _cache_prefix(self):
+        digest = hashlib.sha1(str(self.object_list.query).encode()).hexdigest()
+        return f'accounts:admin-keyset:{digest}:{self.per_page}'
+
+    def _supports_keyset(self):
+        # The admin may repeat the default ordering, e.g. ('-date_joined', '-date_joined', '-pk')
+        return tuple(dict.fromkeys(self.object_list.query.order_by)) == self.keyset_ordering
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if not self._supports_keyset():
+            return super().page(number)
+
+        boundary = cache.get(f'{self._cache_prefix}:{number - 1}') if number > 1 else None
+        if boundary:
+            date_joined, pk = boundary
+            queryset = self.object_list.filter(
+                Q(date_joined__lt=date_joined) | Q(date_joined=date_joined, pk__lt=pk)
+            )[:self.per_page]
+        else:
+            bottom = (number - 1) * self.per_page
+            queryset = self.object_list[bottom:bottom + self.per_page]
+
+        objects = list(queryset)
+        if objects:
+            last = objects[-1]
+            cache.set(f'{self._cache_prefix}:{number}', (last.date_joined, last.pk), self.boundary_timeout)
+        return self._get_page(objects, number, self)
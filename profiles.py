@@ -0,0 +1,24 @@
+from django.utils.http import quote_etag
+
+from .serializers import ProfileSerializer
+from .user_cache import get_user_cache
+
+
+def profile_etag(user_id, version):
+    return quote_etag(f'{user_id}-{version}')
+
+
+def current_profile_etag(user_id):
+    """ETag of the user's current profile, from the version stamp alone."""
+    return profile_etag(user_id, get_user_cache().get_version(user_id))
+
+
+def _serialize(user):
+    # A plain dict pickles without the serializer ReturnDict points back to
+    return dict(ProfileSerializer(user).data)
+
+
+def get_profile(user_id):
+    """Return ``(etag, payload)``; the payload is serialized once per user version."""
+    version, payload = get_user_cache().get_derived(user_id, 'profile', _serialize)
+    return profile_etag(user_id, version), payload
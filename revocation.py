@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+
+from .models import CustomUserModel
+from .routers import pin_to_primary
+from .user_cache import invalidate_user
+
+
+class RevocationMap:
+    """Current token generation per user, for revoking JWTs without a blacklist.
+
+    A token is revoked when its ``gen`` claim is lower than the user's
+    generation. Generations are published in the shared cache and mirrored
+    in a bounded in-process LRU of ``user_id -> (generation, expires_at)``,
+    so a check is a dict lookup; each process rereads a user's entry from
+    the cache at most once per ``sync_interval`` seconds, which bounds how
+    long another worker can keep accepting a revoked token.
+    """
+
+    def __init__(self, maxsize=100000, sync_interval=5, cache_alias='default'):
+        self.maxsize = maxsize
+        self.sync_interval = sync_interval
+        self.cache_alias = cache_alias
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _key(self, user_id):
+        return f'accounts:token-gen:{user_id}'
+
+    def _remember(self, user_id, generation):
+        with self._lock:
+            self._local[user_id] = (generation, time.monotonic() + self.sync_interval)
+            self._local.move_to_end(user_id)
+            while len(self._local) > self.maxsize:
+                self._local.popitem(last=False)
+
+    def generation(self, user_id):
+        # Tokens may carry the id as a string
+        user_id = CustomUserModel._meta.pk.to_python(user_id)
+        entry = self._local.get(user_id)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+
+        generation = self.cache.get(self._key(user_id))
+        if generation is None:
+            # Evicted or never published: the row is the source of truth
+            with pin_to_primary():
+                generation = CustomUserModel.objects.filter(pk=user_id).values_list('token_generation', flat=True).first() or 0
+            self.cache.add(self._key(user_id), generation, timeout=None)
+        self._remember(user_id, generation)
+        return generation
+
+    def is_revoked(self, user_id, token_generation):
+        return (token_generation or 0) < self.generation(user_id)
+
+    def revoke(self, user):
+        """Invalidate every token issued to ``user`` so far."""
+        CustomUserModel.objects.filter(pk=user.pk).update(token_generation=F('token_generation') + 1)
+        with pin_to_primary():
+            user.token_generation = CustomUserModel.objects.filter(pk=user.pk).values_list('token_generation', flat=True).get()
+        self.cache.set(self._key(user.pk), user.token_generation, timeout=None)
+        self._remember(user.pk, user.token_generation)
+        # update() doesn't send post_save
+        invalidate_user(user.pk)
+
+
+@lru_cache(maxsize=None)
+def get_revocation_map():
+    return RevocationMap(
+        maxsize=getattr(settings, 'ACCOUNTS_REVOCATION_MAP_SIZE', 100000),
+        sync_interval=getattr(settings, 'ACCOUNTS_REVOCATION_SYNC_INTERVAL', 5),
+        cache_alias=getattr(settings, 'ACCOUNTS_REVOCATION_CACHE', 'default'),
+    )
+
+
+def revoke_tokens(user):
+    get_revocation_map().revoke(user)
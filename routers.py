@@ -0,0 +1,133 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_pinned = ContextVar('accounts_pinned_to_primary', default=False)
+_request_pin = ContextVar('accounts_request_pin', default=None)
+
+
+class RequestPin:
+    """Read routing state of the request being served."""
+
+    __slots__ = ('sticky', 'wrote', 'replica')
+
+    def __init__(self, sticky=False):
+        # sticky: the client wrote recently, wrote: this request did
+        self.sticky = sticky
+        self.wrote = False
+        self.replica = None
+
+    @property
+    def pinned(self):
+        return self.sticky or self.wrote
+
+
+@contextmanager
+def pin_to_primary():
+    """Send every read of the block to the primary, for lookups that must not be stale."""
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+class AccountsReplicaRouter:
+    """Sends reads of the accounts models to ``ACCOUNTS_READ_DATABASES``.
+
+    Writes always go to the primary. Reads stay on the primary inside a
+    transaction, for the rest of a request once it has written, and, with
+    PrimaryPinningMiddleware, for ``ACCOUNTS_PRIMARY_PIN_SECONDS`` after the
+    client's last write, so a registration followed by an activation or a
+    password change followed by a login never hit a lagging replica.
+    """
+
+    route_app_labels = {'accounts'}
+
+    def __init__(self):
+        self.primary = DEFAULT_DB_ALIAS
+        self.replicas = list(getattr(settings, 'ACCOUNTS_READ_DATABASES', []))
+
+    def _routed(self, model):
+        return model._meta.app_label in self.route_app_labels
+
+    def db_for_read(self, model, **hints):
+        if not self._routed(model) or not self.replicas:
+            return None
+        if _pinned.get() or connections[self.primary].in_atomic_block:
+            return self.primary
+
+        pin = _request_pin.get()
+        if pin is None:
+            return random.choice(self.replicas)
+        if pin.pinned:
+            return self.primary
+        # One replica per request, so its reads never go back in time
+        if pin.replica is None:
+            pin.replica = random.choice(self.replicas)
+        return pin.replica
+
+    def db_for_write(self, model, **hints):
+        if not self._routed(model):
+            return None
+        pin = _request_pin.get()
+        if pin is not None:
+            pin.wrote = True
+        return self.primary
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {self.primary, *self.replicas}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class PrimaryPinningMiddleware:
+    """Pins a client to the primary for a short while after it writes.
+
+    A request that wrote to the accounts tables gets a short-lived cookie;
+    while it is present, the client's reads skip the replicas.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.cookie_name = getattr(settings, 'ACCOUNTS_PRIMARY_PIN_COOKIE', 'accounts_primary')
+        self.pin_seconds = getattr(settings, 'ACCOUNTS_PRIMARY_PIN_SECONDS', 10)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        pin = RequestPin(sticky=self.cookie_name in request.COOKIES)
+        token = _request_pin.set(pin)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_pin.reset(token)
+        return self.process_response(pin, response)
+
+    async def __acall__(self, request):
+        # Sync ORM calls run in a copy of this context but share the same pin object
+        pin = RequestPin(sticky=self.cookie_name in request.COOKIES)
+        token = _request_pin.set(pin)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_pin.reset(token)
+        return self.process_response(pin, response)
+
+    def process_response(self, pin, response):
+        if pin.wrote:
+            response.set_cookie(
+                self.cookie_name, '1', max_age=self.pin_seconds, httponly=True, samesite='Lax',
+                secure=settings.SESSION_COOKIE_SECURE,
+            )
+        return response
@@ -1,30 +1,62 @@
 from rest_framework import serializers
 from .models import CustomUserModel
+from django.conf import settings
 from django.contrib.auth import authenticate
+from django.utils.translation import gettext_lazy as _
+from rest_framework.validators import UniqueValidator
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer as BaseTokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from .revocation import get_revocation_map
+from .tokens import GENERATION_CLAIM
+
+class CanonicalEmailField(serializers.EmailField):
+    """EmailField that returns the address in its canonical (lowercased) form."""
+
+    def to_internal_value(self, data):
+        return CustomUserModel.objects.normalize_email(super().to_internal_value(data))
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
+    # Declared explicitly so uniqueness is checked on the canonical address
+    email = CanonicalEmailField(max_length=255, validators=[
+        UniqueValidator(queryset=CustomUserModel.objects.all(), message=_("User with this Email Address already exists.")),
+    ])
     password = serializers.CharField(write_only=True)
 
     class Meta:
         model = CustomUserModel
         fields = ['email', 'first_name', 'last_name', 'password']
 
+    def create(self, validated_data):
+        # create_user hashes the password instead of storing it raw
+        return CustomUserModel.objects.create_user(**validated_data)
+
+class BulkUserRowSerializer(serializers.Serializer):
+    # No UniqueValidator: existing emails are found with one query for the whole batch
+    email = CanonicalEmailField(max_length=255)
+    first_name = serializers.CharField(max_length=100)
+    last_name = serializers.CharField(max_length=100, required=False, allow_null=True, allow_blank=True)
+    password = serializers.CharField(required=False, write_only=True)
+
+class BulkRegistrationSerializer(serializers.Serializer):
+    users = serializers.ListField(child=serializers.DictField(), allow_empty=False)
+
+    def validate_users(self, value):
+        # Every password in the batch is hashed while the request waits
+        max_rows = getattr(settings, 'ACCOUNTS_BULK_REGISTRATION_MAX_ROWS', 1000)
+        if len(value) > max_rows:
+            raise serializers.ValidationError(_("Ensure this field has no more than {max_rows} elements.").format(max_rows=max_rows))
+        return value
+
 class OTPVerificationSerializer(serializers.Serializer):
     otp = serializers.CharField(max_length=5)
-    email = serializers.EmailField()
-    
-    def validate_otp(self, value):
-        try:
-            user = CustomUserModel.objects.get(otp_code=value, is_active=False, verified_email=False)
-            return user
-        except CustomUserModel.DoesNotExist:
-            raise serializers.ValidationError("Invalid OTP. Please try again.")
+    email = CanonicalEmailField()
 
 class EmailValidateRequestSerializer(serializers.Serializer):
-    email = serializers.EmailField()
+    email = CanonicalEmailField()
 
 class LoginSerializer(serializers.Serializer):
-    email = serializers.EmailField()
+    email = CanonicalEmailField()
     password = serializers.CharField()
 
     def validate(self, data):
@@ -71,7 +103,28 @@ class SetPasswordSerializer(serializers.Serializer):
         return value
     
 class PasswordResetRequestSerializer(serializers.Serializer):
-    email = serializers.EmailField()
+    email = CanonicalEmailField()
 
 class PasswordResetConfirmSerializer(serializers.Serializer):
     new_password = serializers.CharField(min_length=6, write_only=True)
+
+class ProfileSerializer(serializers.ModelSerializer):
+    # None for users who never signed in with Google
+    picture = serializers.ImageField(source='social_identity.picture', read_only=True)
+    picture_url = serializers.URLField(source='social_identity.picture_url', read_only=True)
+
+    class Meta:
+        model = CustomUserModel
+        fields = ['id', 'email', 'first_name', 'last_name', 'picture', 'picture_url', 'verified_email']
+        read_only_fields = fields
+
+class TokenRefreshSerializer(BaseTokenRefreshSerializer):
+    """Refuses refresh tokens older than the user's token generation."""
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user_id = refresh.get(jwt_settings.USER_ID_CLAIM)
+        if user_id is not None and get_revocation_map().is_revoked(user_id, refresh.get(GENERATION_CLAIM)):
+            raise InvalidToken(_("Token has been revoked"))
+        return super().validate(attrs)
+
@@ -0,0 +1,17 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import CustomUserModel, SocialIdentity
+from .user_cache import invalidate_user
+
+
+@receiver(post_save, sender=CustomUserModel)
+@receiver(post_delete, sender=CustomUserModel)
+# The identity's pk is its user's, and the cached profile includes it
+@receiver(post_save, sender=SocialIdentity)
+@receiver(post_delete, sender=SocialIdentity)
+def invalidate_cached_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+    # A concurrent request may re-cache the old row before we commit
+    transaction.on_commit(lambda: invalidate_user(instance.pk))
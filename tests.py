@@ -1,3 +1,1188 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import jwt
+from asgiref.sync import sync_to_async
+from cryptography.hazmat.primitives.asymmetric import rsa
+from PIL import Image
+from django.contrib.admin import site
+from django.contrib.auth.signals import user_login_failed
+from django.contrib.auth.hashers import is_password_usable, make_password
+from django.core import mail
+from django.core.cache import cache
+from django.conf import settings
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.db.models import QuerySet
+from django.db.models.functions import Upper
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .activity import LoginActivityRecorder
+from .avatars import AvatarError, AvatarFetcher
+from .authentication import CachedJWTAuthentication
+from .coalescing import coalescing_stats, get_coalescer
+from .email_templates import get_email_template
+from .google_oauth import get_google_client
+from .hashing import HashingBusy, InlineHashingService, ProcessPoolHashingService, get_hashing_service
+from .management.commands.bench_endpoints import DEFAULT_BASELINE, SCENARIOS
+from .metrics import render_prometheus
+from .models import CustomUserModel, EmailOutbox, OTPCode, PrefixSearchIndex, SocialIdentity
+from .otp import consume_otp, issue_otp, purge_expired_otps
+from .pagination import KeysetPaginator
+from .revocation import RevocationMap, get_revocation_map
+from .routers import pin_to_primary
+from .throttling import get_limiter
+from .urls import urlpatterns
+from .outbox import drain_outbox, queue_depth
+
+
+class FailingEmailBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionError("relay unavailable")
+
+
+class WorkerCrashed(BaseException):
+    pass
+
+
+class CrashingEmailBackend(EmailBackend):
+    """Delivers one message, then dies like a killed worker."""
+
+    def send_messages(self, messages):
+        if mail.outbox:
+            raise WorkerCrashed()
+        return super().send_messages(messages)
+
+
+class RejectingBackend:
+    def authenticate(self, request, **credentials):
+        return None
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class EmailOutboxTests(TestCase):
+    def register(self, email='user@example.com'):
+        return self.client.post(reverse('user-register'), {
+            'email': email, 'first_name': 'Jane', 'password': 'securepassword',
+        })
+
+    def test_registration_queues_email_without_sending(self):
+        response = self.register()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(queue_depth(), 1)
+        self.assertTrue(CustomUserModel.objects.get(email='user@example.com').check_password('securepassword'))
+
+    def test_drain_sends_batch_over_one_connection(self):
+        for i in range(3):
+            self.register(f'user{i}@example.com')
+
+        self.assertEqual(drain_outbox(batch_size=10), (3, 0))
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+        self.assertEqual(queue_depth(), 0)
+        self.assertEqual(drain_outbox(), (0, 0))
+
+    @override_settings(ACCOUNTS_OUTBOX_MAX_ATTEMPTS=2, ACCOUNTS_OUTBOX_RETRY_BACKOFF=10)
+    def test_failed_send_is_retried_with_backoff(self):
+        self.register()
+
+        self.assertEqual(drain_outbox(connection=FailingEmailBackend()), (0, 1))
+        entry = EmailOutbox.objects.get()
+        self.assertEqual(entry.status, EmailOutbox.STATUS_PENDING)
+        self.assertEqual(entry.attempts, 1)
+        self.assertGreater(entry.next_attempt_at, timezone.now() + timedelta(seconds=5))
+        # Not due yet
+        self.assertEqual(drain_outbox(connection=FailingEmailBackend()), (0, 0))
+
+        EmailOutbox.objects.update(next_attempt_at=timezone.now())
+        drain_outbox(connection=FailingEmailBackend())
+        self.assertEqual(EmailOutbox.objects.get().status, EmailOutbox.STATUS_FAILED)
+        self.assertEqual(queue_depth(), 0)
+
+    def test_crash_mid_batch_does_not_resend_delivered_mail(self):
+        for i in range(3):
+            self.register(f'user{i}@example.com')
+
+        with self.assertRaises(WorkerCrashed):
+            drain_outbox(connection=CrashingEmailBackend())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(EmailOutbox.objects.filter(status=EmailOutbox.STATUS_SENT).count(), 1)
+        # Still leased to the dead worker
+        self.assertEqual(drain_outbox(), (0, 0))
+
+        EmailOutbox.objects.filter(status=EmailOutbox.STATUS_SENDING).update(next_attempt_at=timezone.now())
+        self.assertEqual(drain_outbox(), (2, 0))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['user0@example.com', 'user1@example.com', 'user2@example.com'])
+
+    def test_unknown_emails_get_the_same_answer(self):
+        self.register('inactive@example.com')
+        CustomUserModel.objects.create_user('active@example.com', 'Jane', 'pw', is_active=True)
+
+        for name, known in [('email-validate', 'inactive@example.com'), ('password-reset', 'active@example.com')]:
+            with self.subTest(name):
+                response = self.client.post(reverse(name), {'email': known})
+                unknown = self.client.post(reverse(name), {'email': 'nobody@example.com'})
+                self.assertEqual((unknown.status_code, unknown.json()), (response.status_code, response.json()))
+
+
+class EmailTemplateTests(TestCase):
+    def test_render_substitutes_placeholders_and_escapes_html(self):
+        subject, text, html = get_email_template('activation', 'en').render(
+            otp_code='12345', activation_link='https://example.com/?otp=12345&email=a@b.c',
+        )
+
+        self.assertEqual(subject, 'Activate Your Account')
+        self.assertIn('12345', text)
+        self.assertIn('https://example.com/?otp=12345&email=a@b.c', text)
+        self.assertIn('href="https://example.com/?otp=12345&amp;email=a@b.c"', html)
+
+    def test_locale_falls_back_to_language_then_default(self):
+        self.assertEqual(get_email_template('password_reset', 'fr-ca').subject, 'Réinitialisation du mot de passe')
+        self.assertEqual(get_email_template('password_reset', 'de').subject, 'Password Reset Request')
+
+
+class OTPStoreTests(TestCase):
+    def setUp(self):
+        self.user = CustomUserModel.objects.create_user('pending@example.com', 'Jane', 'securepassword')
+
+    def activate(self, email, otp):
+        return self.client.post(reverse('activate-account'), {'email': email, 'otp': otp})
+
+    def test_code_is_consumed_once(self):
+        code = issue_otp(self.user.email)
+
+        self.assertFalse(consume_otp('other@example.com', code))
+        self.assertTrue(consume_otp(self.user.email, code))
+        self.assertFalse(consume_otp(self.user.email, code))
+
+    def test_new_code_replaces_previous_one(self):
+        first = issue_otp(self.user.email)
+        second = issue_otp(self.user.email)
+
+        self.assertEqual(OTPCode.objects.filter(email=self.user.email).count(), 1)
+        if first != second:
+            self.assertFalse(consume_otp(self.user.email, first))
+        self.assertTrue(consume_otp(self.user.email, second))
+
+    def test_activation_with_valid_and_expired_code(self):
+        code = issue_otp(self.user.email)
+        OTPCode.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.activate(self.user.email, code).status_code, 400)
+
+        code = issue_otp(self.user.email)
+        self.assertEqual(self.activate(self.user.email, code).status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_active)
+        self.assertTrue(self.user.verified_email)
+        self.assertFalse(OTPCode.objects.exists())
+
+
+class StubGoogleHandler(BaseHTTPRequestHandler):
+    """Serves /token, /certs and /userinfo like Google's OAuth endpoints."""
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers['Content-Length']))
+        server.hits['token'] += 1
+        now = int(time.time())
+        id_token = jwt.encode({
+            'iss': 'https://accounts.google.com', 'aud': server.audience, 'sub': '1234567890',
+            'email': 'google.user@example.com', 'email_verified': True,
+            'given_name': 'Google', 'family_name': 'User', 'iat': now, 'exp': now + 3600,
+        }, server.private_key, algorithm='RS256', headers={'kid': 'test-key'})
+        self._json({'access_token': 'access', 'id_token': id_token})
+
+    def do_GET(self):
+        server = self.server
+        if self.path.startswith('/certs'):
+            server.hits['certs'] += 1
+            jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(server.private_key.public_key()))
+            jwk.update(kid='test-key', alg='RS256', use='sig')
+            self._json({'keys': [jwk]}, {'Cache-Control': 'public, max-age=300'})
+        else:
+            server.hits['userinfo'] += 1
+            self._json({})
+
+
+class GoogleLoginTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubGoogleHandler)
+        cls.server.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        cls.server.audience = 'test-client-id'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{cls.server.server_port}'
+        cls.settings_override = override_settings(
+            GOOGLE_CLIENT_ID='test-client-id',
+            GOOGLE_TOKEN_URI=f'{base_url}/token',
+            GOOGLE_CERTS_URI=f'{base_url}/certs',
+            GOOGLE_USERINFO_URI=f'{base_url}/userinfo',
+        )
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        get_google_client.cache_clear()
+        self.server.audience = 'test-client-id'
+        self.server.hits = {'token': 0, 'certs': 0, 'userinfo': 0}
+
+    def tearDown(self):
+        get_google_client.cache_clear()
+
+    def google_login(self):
+        return self.client.post(reverse('google-login'), {'code': 'auth-code'})
+
+    def test_id_token_is_verified_with_cached_keys(self):
+        self.assertEqual(self.google_login().status_code, 200)
+        self.assertEqual(self.google_login().status_code, 200)
+
+        self.assertEqual(self.server.hits, {'token': 2, 'certs': 1, 'userinfo': 0})
+        user = CustomUserModel.objects.get(email='google.user@example.com')
+        self.assertEqual(user.social_identity.google_id, '1234567890')
+        self.assertTrue(user.verified_email)
+
+    def test_returning_user_with_unchanged_profile_is_not_written(self):
+        self.assertEqual(self.google_login().status_code, 200)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.google_login().status_code, 200)
+
+        writes = [q['sql'] for q in queries if q['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(writes, [])
+
+    def test_changed_profile_updates_only_changed_columns(self):
+        CustomUserModel.objects.create_user('google.user@example.com', 'Old', 'pw', last_name='User', is_active=True)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.google_login().status_code, 200)
+
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "accounts_customusermodel"')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"last_name"', updates[0])
+        user = CustomUserModel.objects.get(email='google.user@example.com')
+        self.assertEqual((user.first_name, user.social_identity.google_id), ('Google', '1234567890'))
+        self.assertTrue(user.check_password('pw'))
+
+    def test_id_token_for_another_audience_is_rejected(self):
+        self.server.audience = 'someone-else'
+
+        response = self.google_login()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CustomUserModel.objects.exists())
+
+
+@override_settings(ACCOUNTS_THROTTLE_EMAIL_LIMIT=3)
+class LoginThrottleTests(TestCase):
+    def setUp(self):
+        get_limiter.cache_clear()
+        self.user = CustomUserModel.objects.create_user('active@example.com', 'Jane', 'securepassword', is_active=True)
+
+    def tearDown(self):
+        get_limiter.cache_clear()
+        cache.clear()
+
+    def login(self, password):
+        return self.client.post(reverse('login'), {'email': self.user.email, 'password': password})
+
+    def test_successful_login_resets_attempts(self):
+        for _ in range(5):
+            self.assertEqual(self.login('securepassword').status_code, 200)
+
+    def test_lockout_rejects_before_hashing(self):
+        for _ in range(3):
+            self.assertEqual(self.login('wrong').status_code, 400)
+
+        with mock.patch.object(CustomUserModel, 'check_password') as check_password:
+            response = self.login('securepassword')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        check_password.assert_not_called()
+
+    def test_login_goes_through_the_authentication_backends(self):
+        failures = []
+
+        def handler(sender, credentials, **kwargs):
+            failures.append(credentials['email'])
+
+        user_login_failed.connect(handler)
+        self.addCleanup(user_login_failed.disconnect, handler)
+
+        self.assertEqual(self.login('wrong').status_code, 400)
+        self.assertEqual(failures, [self.user.email])
+
+        with override_settings(AUTHENTICATION_BACKENDS=['accounts.tests.RejectingBackend']):
+            self.assertEqual(self.login('securepassword').status_code, 400)
+
+
+class LoginActivityRecorderTests(TestCase):
+    def test_logins_are_flushed_in_one_update(self):
+        users = [CustomUserModel.objects.create_user(f'user{i}@example.com', 'Jane', 'pw') for i in range(3)]
+        recorder = LoginActivityRecorder(flush_interval=3600, max_staleness=3600)
+        logged_in_at = timezone.now() - timedelta(minutes=1)
+
+        with self.assertNumQueries(0):
+            for user in users:
+                recorder.record(user.pk, logged_in_at)
+        with self.assertNumQueries(1):
+            self.assertEqual(recorder.flush(), 3)
+
+        for user in users:
+            user.refresh_from_db()
+            self.assertEqual(user.last_login, logged_in_at)
+        self.assertEqual(recorder.flush(), 0)
+
+    def test_exit_flush_writes_only_to_the_recording_database(self):
+        user = CustomUserModel.objects.create_user('jane@example.com', 'Jane', 'pw')
+        recorder = LoginActivityRecorder(flush_interval=3600, max_staleness=3600)
+
+        recorder.record(user.pk)
+        with mock.patch.dict(connection.settings_dict, NAME='another-database'), self.assertNumQueries(0):
+            recorder.flush_at_exit()
+        recorder.flush_at_exit()
+
+        user.refresh_from_db()
+        self.assertIsNotNone(user.last_login)
+
+    def test_failed_flush_keeps_the_logins_and_lets_the_login_through(self):
+        user = CustomUserModel.objects.create_user('jane@example.com', 'Jane', 'pw')
+        recorder = LoginActivityRecorder(flush_interval=0, max_staleness=3600)
+        logged_in_at = timezone.now() - timedelta(minutes=1)
+
+        failing_update = mock.patch.object(CustomUserModel.objects, 'filter', side_effect=OperationalError('database is locked'))
+        with failing_update, self.assertLogs('accounts.activity', 'ERROR'):
+            recorder.record(user.pk, logged_in_at)
+
+        self.assertEqual(recorder.flush(), 1)
+        user.refresh_from_db()
+        self.assertEqual(user.last_login, logged_in_at)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_revocation_map.cache_clear()
+        self.user = CustomUserModel.objects.create_user('active@example.com', 'Jane', 'securepassword', is_active=True)
+        token = AccessToken.for_user(self.user)
+        self.request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def tearDown(self):
+        cache.clear()
+        get_revocation_map.cache_clear()
+
+    def authenticate(self):
+        return CachedJWTAuthentication().authenticate(self.request)[0]
+
+    def test_warm_authentication_runs_no_queries(self):
+        # Cold: the user row and its token generation
+        with self.assertNumQueries(2):
+            self.authenticate()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate(), self.user)
+
+    def test_password_change_keeps_flushed_last_login(self):
+        self.authenticate()
+        recorder = LoginActivityRecorder(flush_interval=3600, max_staleness=3600)
+        recorder.record(self.user.pk)
+        recorder.flush()
+        logged_in_at = CustomUserModel.objects.get(pk=self.user.pk).last_login
+
+        user = self.authenticate()
+        self.assertEqual(user.last_login, logged_in_at)
+        response = self.client.put(reverse('set-password'), {'new_password': 'new-password'},
+                                   content_type='application/json', HTTP_AUTHORIZATION=self.request.META['HTTP_AUTHORIZATION'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(CustomUserModel.objects.get(pk=self.user.pk).last_login, logged_in_at)
+
+    def test_cache_is_invalidated_on_save(self):
+        self.authenticate()
+
+        self.user.first_name = 'Janet'
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authenticate().first_name, 'Janet')
+
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+
+class ImportExportTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def run_import(self, rows):
+        path = f'{self.directory}/users.jsonl'
+        with open(path, 'w', encoding='utf-8') as stream:
+            stream.writelines(json.dumps(row) + '\n' for row in rows)
+        stderr = io.StringIO()
+        call_command('import_users', path, '--workers', '1', stdout=io.StringIO(), stderr=stderr)
+        return stderr.getvalue()
+
+    def test_export_import_round_trip_keeps_every_column(self):
+        joined = timezone.now() - timedelta(days=400)
+        CustomUserModel.objects.create_superuser(
+            'admin@example.com', 'Ada', 'pw', last_name='Admin', is_active=True, verified_email=True,
+            date_joined=joined, last_login=joined + timedelta(days=1),
+        )
+        CustomUserModel.objects.create_user('jane@example.com', 'Jane', 'pw', date_joined=joined)
+        fields = ['email', 'first_name', 'last_name', 'is_active', 'is_staff', 'is_superuser', 'verified_email',
+                  'date_joined', 'last_login', 'password']
+        before = list(CustomUserModel.objects.order_by('email').values(*fields))
+
+        path = f'{self.directory}/users.jsonl'
+        call_command('export_users', path, '--include-password-hash', stdout=io.StringIO())
+        CustomUserModel.objects.all().delete()
+        call_command('import_users', path, '--workers', '1', stdout=io.StringIO())
+
+        self.assertEqual(list(CustomUserModel.objects.order_by('email').values(*fields)), before)
+
+    def test_invalid_rows_are_rejected(self):
+        errors = self.run_import([
+            {'email': 'not-an-email', 'first_name': 'Bad'},
+            {'email': 'nameless@example.com'},
+            {'email': 'late@example.com', 'first_name': 'Late', 'date_joined': 'yesterday'},
+            {'email': 'Good@Example.com', 'first_name': 'Good', 'password': 'pw'},
+        ])
+
+        self.assertEqual(list(CustomUserModel.objects.values_list('email', flat=True)), ['good@example.com'])
+        self.assertIn('Rejected not-an-email', errors)
+        self.assertIn('Rejected nameless@example.com', errors)
+        self.assertIn('Rejected late@example.com', errors)
+
+    def test_rows_registered_concurrently_are_skipped(self):
+        path = f'{self.directory}/users.jsonl'
+        with open(path, 'w', encoding='utf-8') as stream:
+            stream.write(json.dumps({'email': 'racy@example.com', 'first_name': 'Racy', 'password': 'pw'}) + '\n')
+            stream.write(json.dumps({'email': 'calm@example.com', 'first_name': 'Calm', 'password': 'pw'}) + '\n')
+        pool_map = ProcessPoolExecutor.map
+
+        def register_first(pool, *args, **kwargs):
+            # The account signs up between the existence check and the insert
+            racy = CustomUserModel.objects.create_user('racy@example.com', 'Racy', 'pw')
+            self.code = issue_otp(racy.email)
+            return pool_map(pool, *args, **kwargs)
+
+        stdout = io.StringIO()
+        with mock.patch.object(ProcessPoolExecutor, 'map', autospec=True, side_effect=register_first):
+            call_command('import_users', path, '--workers', '1', '--send-activation',
+                         '--activation-url', 'https://example.com/api/activate/', stdout=stdout)
+
+        self.assertIn('Imported 1 user(s), skipped 1', stdout.getvalue())
+        self.assertEqual(queue_depth(), 1)
+        self.assertTrue(consume_otp('racy@example.com', self.code))
+
+
+class PurgeUnverifiedAccountsTests(TestCase):
+    def create_unverified(self, email, otp_expired_days_ago=None):
+        user = CustomUserModel.objects.create_user(email, 'Jane', 'pw', date_joined=timezone.now() - timedelta(days=30))
+        if otp_expired_days_ago is not None:
+            with override_settings(ACCOUNTS_OTP_TTL=timedelta(days=-otp_expired_days_ago)):
+                issue_otp(email)
+        return user
+
+    def purge(self, *args):
+        stdout = io.StringIO()
+        call_command('purge_unverified_accounts', '--days', '7', '--sleep', '0', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_expired_codes_are_kept_for_the_grace_period(self):
+        self.create_unverified('recent@example.com', otp_expired_days_ago=2)
+        purge_expired_otps(force=True)
+        self.assertTrue(OTPCode.objects.exists())
+
+        self.assertIn('0 account(s) would be deleted', self.purge('--dry-run'))
+        self.purge()
+        self.assertTrue(CustomUserModel.objects.filter(email='recent@example.com').exists())
+        self.assertTrue(OTPCode.objects.exists())
+
+    def test_accounts_activated_during_the_batch_are_kept(self):
+        self.create_unverified('late@example.com')
+        values_list = QuerySet.values_list
+
+        def activate_after_select(queryset, *fields, **kwargs):
+            rows = list(values_list(queryset, *fields, **kwargs))
+            CustomUserModel.objects.filter(email='late@example.com').update(is_active=True)
+            return rows
+
+        with mock.patch.object(QuerySet, 'values_list', autospec=True, side_effect=activate_after_select):
+            output = self.purge()
+
+        self.assertIn('Deleted 0 unverified account(s)', output)
+        self.assertTrue(CustomUserModel.objects.filter(email='late@example.com').exists())
+
+    def test_purges_accounts_past_the_grace_period(self):
+        self.create_unverified('stale@example.com', otp_expired_days_ago=10)
+        self.create_unverified('never@example.com')
+        CustomUserModel.objects.create_user('active@example.com', 'Jane', 'pw', is_active=True, date_joined=timezone.now() - timedelta(days=30))
+
+        self.purge()
+
+        self.assertEqual(list(CustomUserModel.objects.values_list('email', flat=True)), ['active@example.com'])
+        self.assertFalse(OTPCode.objects.exists())
+
+
+@override_settings(ACCOUNTS_ADMIN_HIGH_VOLUME=True)
+class HighVolumeAdminTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(5):
+            CustomUserModel.objects.create_user(f'user{i}@example.com', f'Jane{i}', 'pw')
+
+    def test_next_page_is_fetched_by_keyset(self):
+        queryset = CustomUserModel.objects.order_by('-date_joined', '-pk')
+        expected = list(queryset)
+
+        paginator = KeysetPaginator(queryset, 2)
+        first = list(paginator.page(1))
+        with CaptureQueriesContext(connection) as queries:
+            second = list(paginator.page(2))
+
+        self.assertEqual(first + second, expected[:4])
+        self.assertNotIn('OFFSET', queries[-1]['sql'].upper())
+
+    def test_changelist_search(self):
+        admin_user = CustomUserModel.objects.create_superuser('admin@example.com', 'Admin', 'pw', is_active=True)
+        self.client.force_login(admin_user)
+        url = reverse('admin:accounts_customusermodel_changelist')
+
+        response = self.client.get(url, {'q': 'jane3'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['cl'].result_list), [CustomUserModel.objects.get(email='user3@example.com')])
+
+        response = self.client.get(url, {'q': 'user1@EXAMPLE.COM'})
+        self.assertEqual(list(response.context['cl'].result_list), [CustomUserModel.objects.get(email='user1@example.com')])
+
+        response = self.client.get(url, {'q': 'USER2'})
+        self.assertEqual(list(response.context['cl'].result_list), [CustomUserModel.objects.get(email='user2@example.com')])
+
+    def test_name_search_matches_the_upper_index(self):
+        CustomUserModel.objects.create_user('other@example.com', 'jANE-marie', 'pw')
+        admin = site._registry[CustomUserModel]
+        queryset, _ = admin.get_search_results(None, CustomUserModel.objects.all(), 'Jane-M')
+
+        self.assertEqual([user.email for user in queryset], ['other@example.com'])
+        def column(expression):
+            # Col in the query, F in the index definition
+            if isinstance(expression, Upper):
+                return f'UPPER({column(expression.source_expressions[0])})'
+            return getattr(expression, 'target', expression).name
+
+        [prefix_search] = queryset.query.where.children
+        lookups = {(column(lookup.lhs), lookup.lookup_name, lookup.rhs) for lookup in prefix_search.children}
+        self.assertEqual(lookups, {
+            ('email', 'startswith', 'jane-m'),
+            ('UPPER(first_name)', 'startswith', 'JANE-M'),
+            ('UPPER(last_name)', 'startswith', 'JANE-M'),
+        })
+        # Case-sensitive prefix matches on exactly the indexed expressions
+        indexed = {column(index.expressions[0]) for index in CustomUserModel._meta.indexes if isinstance(index, PrefixSearchIndex)}
+        self.assertEqual(indexed, {'UPPER(first_name)', 'UPPER(last_name)'})
+
+    def test_name_indexes_use_pattern_ops_on_postgresql(self):
+        index = next(index for index in CustomUserModel._meta.indexes if index.name == 'accounts_user_fname_upper_idx')
+        editor = connection.schema_editor()
+
+        self.assertNotIn('pattern_ops', str(index.create_sql(CustomUserModel, editor)))
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            sql = str(index.create_sql(CustomUserModel, editor))
+        self.assertIn('(UPPER("first_name") varchar_pattern_ops)', sql)
+
+
+class BenchEndpointsTests(SimpleTestCase):
+    def test_every_route_runs(self):
+        # The command sets up its own test database, so it runs in a process of its own
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        result = subprocess.run(
+            [sys.executable, '-m', 'django', 'bench_endpoints', '--requests', '1', '--alloc-samples', '0', '--fast-hasher'],
+            env=env, capture_output=True, text=True, timeout=300,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+        routes = {str(pattern.pattern).split('<')[0] for pattern in urlpatterns}
+        benched = {line.split()[0] for line in result.stdout.splitlines()[1:]}
+        self.assertEqual(benched, routes)
+
+    def test_committed_baseline_covers_every_scenario(self):
+        with open(DEFAULT_BASELINE) as fh:
+            baseline = json.load(fh)
+
+        self.assertEqual(set(baseline), {scenario.name for scenario in SCENARIOS})
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_limiter.cache_clear()
+        self.user = CustomUserModel.objects.create_user('jane@example.com', 'Jane', 'pw', is_active=True)
+
+    @override_settings(ACCOUNTS_METRICS_TOKEN='secret')
+    def test_login_phases_are_exported(self):
+        self.client.post(reverse('login'), {'email': 'jane@example.com', 'password': 'pw'})
+
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        for phase in ('request', 'db_query', 'password_verify'):
+            self.assertIn(f'accounts_phase_duration_seconds_count{{phase="{phase}",view="LoginView"}}', body)
+        self.assertIn('accounts_throttle_attempts_total{scope="email",outcome="allowed"}', body)
+        self.assertIn('accounts_email_outbox_depth 0', body)
+
+    def test_endpoint_is_closed_without_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertTrue(render_prometheus().endswith('\n'))
+
+
+class StubPictureHandler(BaseHTTPRequestHandler):
+    """Serves one PNG per path with an ETag, honouring If-None-Match."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.hits += 1
+        etag = '"%s"' % self.path.strip('/')
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(server.image)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(server.image)
+
+
+class AvatarFetcherTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        buffer = io.BytesIO()
+        Image.new('RGB', (400, 300), 'red').save(buffer, format='PNG')
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubPictureHandler)
+        cls.server.image = buffer.getvalue()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = 'http://127.0.0.1:%d' % cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.hits = 0
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.fetcher = AvatarFetcher(size=64)
+
+    def create_identity(self, email, path):
+        user = CustomUserModel.objects.create_user(email, 'Jane', 'pw')
+        return SocialIdentity.objects.create(user=user, picture_url=f'{self.base_url}/{path}')
+
+    def test_picture_is_thumbnailed_and_revalidated(self):
+        identity = self.create_identity('jane@example.com', 'a')
+
+        self.assertTrue(self.fetcher.ingest(identity.pk))
+        self.assertFalse(self.fetcher.ingest(identity.pk))
+
+        self.assertEqual(self.server.hits, 2)
+        identity.refresh_from_db()
+        self.assertEqual(identity.picture_etag, '"a"')
+        with Image.open(identity.picture.path) as image:
+            self.assertEqual(image.size, (64, 64))
+
+    def test_identical_pictures_share_one_file(self):
+        first = self.create_identity('one@example.com', 'a')
+        second = self.create_identity('two@example.com', 'b')
+
+        self.fetcher.ingest(first.pk)
+        self.fetcher.ingest(second.pk)
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.picture.name, second.picture.name)
+
+    def test_oversized_picture_is_rejected(self):
+        identity = self.create_identity('jane@example.com', 'a')
+        self.fetcher.max_bytes = 100
+
+        with self.assertRaises(AvatarError):
+            self.fetcher.ingest(identity.pk)
+        identity.refresh_from_db()
+        self.assertFalse(identity.picture)
+
+
+class BulkRegistrationTests(TestCase):
+    def setUp(self):
+        self.admin = CustomUserModel.objects.create_superuser('admin@example.com', 'Admin', 'pw', is_active=True)
+        CustomUserModel.objects.create_user('taken@example.com', 'Taken', 'pw')
+        self.url = reverse('user-register-bulk')
+
+    def post(self, user, payload):
+        return self.client.post(self.url, payload, content_type='application/json',
+                                HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+    def test_rows_are_reported_individually(self):
+        payload = {'users': [
+            {'email': 'new1@example.com', 'first_name': 'One', 'password': 'secret123'},
+            {'email': 'new2@Example.com', 'first_name': 'Two'},
+            {'email': 'taken@example.com', 'first_name': 'Taken'},
+            {'email': 'new1@example.com', 'first_name': 'Again'},
+            {'email': 'not-an-email', 'first_name': 'Bad'},
+        ]}
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(self.admin, payload)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([r['status'] for r in response.data['results']], ['created', 'created', 'exists', 'exists', 'invalid'])
+        # The existing emails, then the rows this request actually inserted
+        self.assertEqual(sum('SELECT' in q['sql'] and '"email" IN' in q['sql'] for q in queries), 2)
+        self.assertTrue(CustomUserModel.objects.get(email='new1@example.com').check_password('secret123'))
+        self.assertFalse(CustomUserModel.objects.get(email='new2@example.com').has_usable_password())
+        self.assertEqual(OTPCode.objects.count(), 2)
+        self.assertEqual(queue_depth(), 2)
+
+    def test_rows_inserted_concurrently_are_not_reported_as_created(self):
+        hash_many = InlineHashingService.hash_many
+
+        def register_first(service, raw_passwords):
+            # Another request wins the race between the existence check and the insert
+            CustomUserModel.objects.create_user('racy@example.com', 'Racy', 'pw')
+            return hash_many(service, raw_passwords)
+
+        payload = {'users': [
+            {'email': 'racy@example.com', 'first_name': 'Racy'},
+            {'email': 'calm@example.com', 'first_name': 'Calm'},
+        ]}
+        with mock.patch.object(InlineHashingService, 'hash_many', autospec=True, side_effect=register_first):
+            response = self.post(self.admin, payload)
+
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([r['status'] for r in response.data['results']], ['exists', 'created'])
+        self.assertEqual(list(OTPCode.objects.values_list('email', flat=True)), ['calm@example.com'])
+        self.assertEqual(queue_depth(), 1)
+
+    def test_batch_size_is_capped(self):
+        users = [{'email': f'user{i}@example.com', 'first_name': 'User'} for i in range(500)]
+
+        self.assertEqual(self.post(self.admin, {'users': users}).status_code, 201)
+        with override_settings(ACCOUNTS_BULK_REGISTRATION_MAX_ROWS=499):
+            self.assertEqual(self.post(self.admin, {'users': users}).status_code, 400)
+
+    def test_staff_only(self):
+        user = CustomUserModel.objects.create_user('jane@example.com', 'Jane', 'pw', is_active=True)
+
+        response = self.post(user, {'users': [{'email': 'new@example.com', 'first_name': 'New'}]})
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(CustomUserModel.objects.filter(email='new@example.com').exists())
+
+
+class RequestCoalescingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_coalescer.cache_clear()
+        self.addCleanup(get_coalescer.cache_clear)
+
+    def test_repeated_password_reset_sends_one_email(self):
+        user = CustomUserModel.objects.create_user('jane@example.com', 'Jane', 'pw', is_active=True)
+        before = coalescing_stats().get(('password_reset', 'coalesced'), 0)
+
+        for _ in range(3):
+            response = self.client.post(reverse('password-reset'), {'email': user.email})
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(queue_depth(), 1)
+        self.assertEqual(coalescing_stats()[('password_reset', 'coalesced')], before + 2)
+
+    def test_repeated_otp_resend_keeps_the_outstanding_code(self):
+        user = CustomUserModel.objects.create_user('jane@example.com', 'Jane', 'pw')
+
+        self.client.post(reverse('email-validate'), {'email': user.email})
+        code_hash = OTPCode.objects.get().code_hash
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('email-validate'), {'email': user.email})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(OTPCode.objects.get().code_hash, code_hash)
+        self.assertEqual(queue_depth(), 1)
+        self.assertFalse([q for q in queries if q['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))])
+
+    @override_settings(ACCOUNTS_COALESCE_WINDOW=0)
+    def test_window_of_zero_disables_coalescing(self):
+        user = CustomUserModel.objects.create_user('jane@example.com', 'Jane', 'pw', is_active=True)
+
+        self.client.post(reverse('password-reset'), {'email': user.email})
+        self.client.post(reverse('password-reset'), {'email': user.email})
+
+        self.assertEqual(queue_depth(), 2)
+
+
+@override_settings(ROOT_URLCONF='accounts.async_urls')
+class AsyncGoogleLoginTests(GoogleLoginTests):
+    """The Google login scenarios against the async views."""
+
+
+@override_settings(ROOT_URLCONF='accounts.async_urls')
+class AsyncLoginThrottleTests(LoginThrottleTests):
+    """The throttle scenarios against the async views."""
+
+
+@override_settings(ROOT_URLCONF='accounts.async_urls')
+class AsyncViewTests(TestCase):
+    def tearDown(self):
+        cache.clear()
+        get_revocation_map.cache_clear()
+
+    def test_registration_activation_and_password_change(self):
+        response = self.client.post(reverse('user-register'), {'email': 'jane@example.com', 'first_name': 'Jane', 'password': 'first-pw'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.post(reverse('user-register'), {'email': 'jane@example.com', 'first_name': 'Jane', 'password': 'x'}).status_code, 400)
+
+        code = re.search(r'otp=(\d+)', EmailOutbox.objects.get().body_text).group(1)
+        response = self.client.get(reverse('activate-account'), {'email': 'jane@example.com', 'otp': code})
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.post(reverse('login'), {'email': 'jane@example.com', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'non_field_errors': ['Invalid email or password.']})
+
+        access = self.client.post(reverse('login'), {'email': 'jane@example.com', 'password': 'first-pw'}).json()['access']
+        self.assertEqual(self.client.put(reverse('change-password'), {}, content_type='application/json').status_code, 401)
+        response = self.client.put(
+            reverse('change-password'), {'old_password': 'first-pw', 'new_password': 'second-pw'},
+            content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {access}',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(CustomUserModel.objects.get(email='jane@example.com').check_password('second-pw'))
+
+    async def test_concurrent_logins(self):
+        await sync_to_async(CustomUserModel.objects.create_user)('jane@example.com', 'Jane', 'pw', is_active=True)
+
+        responses = await asyncio.gather(*[
+            self.async_client.post(reverse('login'), {'email': 'jane@example.com', 'password': 'pw'}, content_type='application/json')
+            for _ in range(10)
+        ])
+
+        self.assertEqual({response.status_code for response in responses}, {200})
+
+
+class HashingServiceTests(TestCase):
+    def tearDown(self):
+        get_hashing_service.cache_clear()
+
+    @override_settings(PASSWORD_HASHERS=[
+        'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+        'django.contrib.auth.hashers.MD5PasswordHasher',
+    ])
+    def test_login_upgrades_outdated_hash(self):
+        user = CustomUserModel.objects.create_user('jane@example.com', 'Jane', is_active=True)
+        CustomUserModel.objects.filter(pk=user.pk).update(password=make_password('pw', hasher='md5'))
+
+        response = self.client.post(reverse('login'), {'email': 'jane@example.com', 'password': 'pw'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(CustomUserModel.objects.get(pk=user.pk).password.startswith('pbkdf2_sha256$'))
+
+    def test_process_pool_hashes_and_verifies(self):
+        service = ProcessPoolHashingService(workers=1, max_pending=1)
+        self.addCleanup(service.executor.shutdown)
+
+        encoded = service.hash('secret')
+
+        self.assertEqual(service.verify('secret', encoded), (True, False))
+        self.assertEqual(service.verify('wrong', encoded), (False, False))
+        self.assertEqual(service.verify('secret', '!unusable'), (False, False))
+
+    def test_process_pool_hashes_batches(self):
+        service = ProcessPoolHashingService(workers=2, max_pending=2)
+        self.addCleanup(service.executor.shutdown)
+
+        hashes = service.hash_many(['one', None, 'two'])
+
+        self.assertEqual(service.verify('one', hashes[0]), (True, False))
+        self.assertFalse(is_password_usable(hashes[1]))
+        self.assertEqual(service.verify('two', hashes[2]), (True, False))
+
+    def test_full_queue_fails_fast(self):
+        service = ProcessPoolHashingService(workers=1, max_pending=1, queue_timeout=0.01)
+        service._slots.acquire()
+
+        with self.assertRaises(HashingBusy):
+            service.hash('secret')
+
+    @override_settings(ACCOUNTS_HASHING_SERVICE='accounts.hashing.ProcessPoolHashingService', ACCOUNTS_HASHING_WORKERS=1)
+    def test_models_use_the_configured_service(self):
+        get_hashing_service.cache_clear()
+        service = get_hashing_service()
+        self.addCleanup(lambda: service.executor.shutdown())
+
+        user = CustomUserModel.objects.create_user('jane@example.com', 'Jane', 'pw')
+
+        self.assertIsInstance(service, ProcessPoolHashingService)
+        self.assertTrue(user.check_password('pw'))
+
+
+class CanonicalEmailTests(TestCase):
+    def tearDown(self):
+        cache.clear()
+
+    def test_lookups_ignore_case(self):
+        response = self.client.post(reverse('user-register'), {'email': ' Jane@Example.COM', 'first_name': 'Jane', 'password': 'pw'})
+        self.assertEqual(response.status_code, 201)
+        user = CustomUserModel.objects.get()
+        self.assertEqual(user.email, 'jane@example.com')
+
+        response = self.client.post(reverse('user-register'), {'email': 'JANE@example.com', 'first_name': 'Jane', 'password': 'pw'})
+        self.assertEqual(response.status_code, 400)
+
+        CustomUserModel.objects.filter(pk=user.pk).update(is_active=True)
+        response = self.client.post(reverse('login'), {'email': 'JANE@EXAMPLE.COM', 'password': 'pw'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(reverse('password-reset'), {'email': 'Jane@example.com'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_dedupe_command_normalizes_stored_emails(self):
+        user = CustomUserModel.objects.create_user('jane@example.com', 'Jane', 'pw')
+        CustomUserModel.objects.filter(pk=user.pk).update(email='Jane@Example.com')
+
+        call_command('dedupe_emails', stdout=io.StringIO())
+
+        user.refresh_from_db()
+        self.assertEqual(user.email, 'jane@example.com')
+
+
+class TokenRevocationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_revocation_map.cache_clear()
+        self.user = CustomUserModel.objects.create_user('jane@example.com', 'Jane', 'pw', is_active=True)
+
+    def tearDown(self):
+        cache.clear()
+        get_revocation_map.cache_clear()
+
+    def login(self, password='pw'):
+        return self.client.post(reverse('login'), {'email': 'jane@example.com', 'password': password}).json()
+
+    def change_password(self, access, old, new):
+        return self.client.put(reverse('change-password'), {'old_password': old, 'new_password': new},
+                               content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def test_password_change_revokes_issued_tokens(self):
+        tokens = self.login()
+        self.assertEqual(self.client.post(reverse('token-refresh'), {'refresh': tokens['refresh']}).status_code, 200)
+
+        self.assertEqual(self.change_password(tokens['access'], 'pw', 'new-pw').status_code, 200)
+
+        self.assertEqual(self.change_password(tokens['access'], 'new-pw', 'other').status_code, 401)
+        self.assertEqual(self.client.post(reverse('token-refresh'), {'refresh': tokens['refresh']}).status_code, 401)
+        fresh = self.login('new-pw')
+        self.assertEqual(self.client.post(reverse('token-refresh'), {'refresh': fresh['refresh']}).status_code, 200)
+
+    def test_warm_checks_stay_in_memory(self):
+        revocations = RevocationMap(sync_interval=60)
+        revocations.revoke(self.user)
+        other_process = RevocationMap(sync_interval=60)
+
+        self.assertTrue(other_process.is_revoked(self.user.pk, 0))
+        with self.assertNumQueries(0):
+            self.assertFalse(other_process.is_revoked(self.user.pk, 1))
+        with mock.patch.object(RevocationMap, 'cache') as shared_cache:
+            self.assertFalse(other_process.is_revoked(self.user.pk, 1))
+        shared_cache.get.assert_not_called()
+
+
+
+class ProfileViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUserModel.objects.create_user('jane@example.com', 'Jane', 'pw', is_active=True)
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def tearDown(self):
+        cache.clear()
+        get_revocation_map.cache_clear()
+
+    def test_unchanged_profile_is_not_modified(self):
+        response = self.client.get(reverse('me'), **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['email'], 'jane@example.com')
+        self.assertFalse(response.json()['verified_email'])
+        self.assertIsNone(response.json()['picture_url'])
+        etag = response['ETag']
+
+        with self.assertNumQueries(0), mock.patch('accounts.profiles.ProfileSerializer') as serializer:
+            response = self.client.get(reverse('me'), HTTP_IF_NONE_MATCH=etag, **self.auth)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        serializer.assert_not_called()
+
+    def test_payload_is_cached_until_the_user_is_saved(self):
+        etag = self.client.get(reverse('me'), **self.auth)['ETag']
+        with self.assertNumQueries(0), mock.patch('accounts.profiles.ProfileSerializer') as serializer:
+            self.assertEqual(self.client.get(reverse('me'), **self.auth).json()['first_name'], 'Jane')
+        serializer.assert_not_called()
+
+        self.user.first_name = 'Janet'
+        self.user.save()
+        response = self.client.get(reverse('me'), HTTP_IF_NONE_MATCH=etag, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['first_name'], 'Janet')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_requires_authentication(self):
+        self.assertEqual(self.client.get(reverse('me')).status_code, 401)
+
+
+@override_settings(ROOT_URLCONF='accounts.async_urls')
+class AsyncProfileViewTests(ProfileViewTests):
+    """The profile scenarios against the async view."""
+
+
+@skipUnless('replica' in settings.DATABASES, "needs a 'replica' database alias")
+@override_settings(DATABASE_ROUTERS=['accounts.routers.AccountsReplicaRouter'], ACCOUNTS_READ_DATABASES=['replica'])
+@modify_settings(MIDDLEWARE={'append': 'accounts.routers.PrimaryPinningMiddleware'})
+class ReplicaRoutingTests(TransactionTestCase):
+    # Two SQLite databases that never replicate: rows only on the primary stand for replication lag.
+    # Not a TestCase, reads inside its wrapping transaction would all stay on the primary.
+    # The runner reads databases even for skipped classes, so only ask for an alias that exists.
+    databases = {'default', 'replica'} if 'replica' in settings.DATABASES else {'default'}
+
+    def setUp(self):
+        cache.clear()
+        get_revocation_map.cache_clear()
+        self.user = CustomUserModel.objects.create_user('jane@example.com', 'Jane', 'pw', is_active=True)
+
+    def tearDown(self):
+        cache.clear()
+        get_revocation_map.cache_clear()
+
+    def login(self, client, password):
+        return client.post(reverse('login'), {'email': 'jane@example.com', 'password': password})
+
+    def test_reads_go_to_the_replica_unless_pinned(self):
+        users = CustomUserModel.objects.filter(email='jane@example.com')
+        self.assertFalse(users.exists())
+        with pin_to_primary():
+            self.assertTrue(users.exists())
+        with transaction.atomic():
+            self.assertTrue(users.exists())
+
+    def test_client_sticks_to_the_primary_after_a_write(self):
+        self.user.save(using='replica', force_insert=True)
+        access = AccessToken.for_user(self.user)
+
+        response = self.client.put(reverse('change-password'), {'old_password': 'pw', 'new_password': 'new-pw'},
+                                   content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('accounts_primary', response.cookies)
+
+        self.assertEqual(self.login(self.client, 'new-pw').status_code, 200)
+        # Another client reads the lagging replica, which still has the old password
+        self.assertEqual(self.login(Client(), 'new-pw').status_code, 400)
+        response = self.login(Client(), 'pw')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('accounts_primary', response.cookies)
+
+
+class SocialIdentityTests(TestCase):
+    def add_legacy_columns(self):
+        table = connection.ops.quote_name(CustomUserModel._meta.db_table)
+        with connection.cursor() as cursor:
+            for column in ['google_id', 'picture_url', 'picture', 'picture_etag', 'picture_last_modified']:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} varchar(255) NULL')
+
+    def set_legacy(self, user, **values):
+        table = connection.ops.quote_name(CustomUserModel._meta.db_table)
+        assignments = ', '.join(f'{column} = %s' for column in values)
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE {table} SET {assignments} WHERE id = %s', [*values.values(), user.pk])
+
+    def test_backfill_copies_legacy_columns_once(self):
+        self.add_legacy_columns()
+        first, second, plain, relinked = [
+            CustomUserModel.objects.create_user(f'user{i}@example.com', 'Jane', 'pw') for i in range(4)
+        ]
+        self.set_legacy(first, google_id='g1', picture_url='https://example.com/1.jpg', picture='user_pictures/1.jpg')
+        self.set_legacy(second, google_id='g1', picture_url='https://example.com/2.jpg')
+        self.set_legacy(relinked, google_id='g2', picture_url='https://example.com/old.jpg')
+        # Signed in again after the deploy, this row is newer than the legacy columns
+        SocialIdentity.objects.create(user=relinked, google_id='g2', picture_url='https://example.com/new.jpg')
+
+        call_command('backfill_social_identities', batch_size=2, sleep=0, stdout=io.StringIO())
+        call_command('backfill_social_identities', batch_size=2, sleep=0, stdout=io.StringIO())
+
+        identities = {identity.user_id: identity for identity in SocialIdentity.objects.all()}
+        self.assertEqual(set(identities), {first.pk, second.pk, relinked.pk})
+        self.assertEqual((identities[first.pk].google_id, identities[first.pk].picture.name), ('g1', 'user_pictures/1.jpg'))
+        self.assertEqual((identities[second.pk].google_id, identities[second.pk].picture_url), (None, 'https://example.com/2.jpg'))
+        self.assertEqual(identities[relinked.pk].picture_url, 'https://example.com/new.jpg')
+
+    def test_backfill_without_legacy_columns_is_a_no_op(self):
+        out = io.StringIO()
+        call_command('backfill_social_identities', stdout=out)
+        self.assertIn('nothing to backfill', out.getvalue())
+
+    def test_google_id_follows_the_account_it_signs_in(self):
+        old = CustomUserModel.objects.create_user('old@example.com', 'Jane', 'pw')
+        SocialIdentity.objects.create(user=old, google_id='g1')
+
+        user, created = CustomUserModel.objects.upsert_google_user('new@example.com', google_id='g1', first_name='Jane')
+
+        self.assertTrue(created)
+        self.assertEqual(SocialIdentity.objects.get(google_id='g1').user_id, user.pk)
+        self.assertIsNone(SocialIdentity.objects.get(pk=old.pk).google_id)
@@ -0,0 +1,151 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _incr_stat(scope, outcome):
+    with _stats_lock:
+        _stats[(scope, outcome)] += 1
+
+
+def throttle_stats():
+    """Snapshot of ``{(scope, outcome): count}`` since process start."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+class SlidingWindowLimiter:
+    """Sliding-window attempt counter with lockout.
+
+    Counters live in the shared cache (two fixed buckets weighted into a
+    sliding window), lockouts are mirrored in process memory so a locked-out
+    client is rejected without any cache round trip.
+    """
+
+    MAX_LOCAL_LOCKOUTS = 10000
+
+    def __init__(self, scope, limit, window, lockout, cache_alias='default'):
+        self.scope = scope
+        self.limit = limit
+        self.window = window
+        self.lockout = lockout
+        self.cache_alias = cache_alias
+        self._local_lockouts = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _key(self, identifier, suffix):
+        digest = hashlib.sha1(identifier.encode()).hexdigest()
+        return f'accounts:throttle:{self.scope}:{digest}:{suffix}'
+
+    def locked_for(self, identifier, now=None):
+        now = now or time.time()
+        until = self._local_lockouts.get(identifier)
+        if until is None or until <= now:
+            until = self.cache.get(self._key(identifier, 'lock'))
+            if until is None:
+                return 0
+            self._remember_lockout(identifier, until, now)
+        return max(0, until - now)
+
+    def _remember_lockout(self, identifier, until, now):
+        with self._lock:
+            if len(self._local_lockouts) >= self.MAX_LOCAL_LOCKOUTS:
+                self._local_lockouts = {k: v for k, v in self._local_lockouts.items() if v > now}
+            self._local_lockouts[identifier] = until
+
+    def _incr(self, key):
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            self.cache.add(key, 0, timeout=self.window * 2)
+            return self.cache.incr(key)
+
+    def hit(self, identifier):
+        """Record an attempt and return the seconds to wait, 0 when allowed."""
+        now = time.time()
+        wait = self.locked_for(identifier, now)
+        if wait:
+            _incr_stat(self.scope, 'rejected')
+            return wait
+
+        bucket, elapsed = divmod(now, self.window)
+        current = self._incr(self._key(identifier, int(bucket)))
+        previous = self.cache.get(self._key(identifier, int(bucket) - 1), 0)
+        estimate = previous * (1 - elapsed / self.window) + current
+
+        if estimate > self.limit:
+            until = now + self.lockout
+            self.cache.set(self._key(identifier, 'lock'), until, timeout=self.lockout)
+            self._remember_lockout(identifier, until, now)
+            _incr_stat(self.scope, 'locked_out')
+            return self.lockout
+
+        _incr_stat(self.scope, 'allowed')
+        return 0
+
+    def reset(self, identifier):
+        bucket = int(time.time() // self.window)
+        self.cache.delete_many([self._key(identifier, bucket), self._key(identifier, bucket - 1)])
+
+
+def _limiter(scope, limit_setting, default_limit):
+    return SlidingWindowLimiter(
+        scope,
+        limit=getattr(settings, limit_setting, default_limit),
+        window=getattr(settings, 'ACCOUNTS_THROTTLE_WINDOW', 300),
+        lockout=getattr(settings, 'ACCOUNTS_THROTTLE_LOCKOUT', 900),
+        cache_alias=getattr(settings, 'ACCOUNTS_THROTTLE_CACHE', 'default'),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_limiter(scope):
+    if scope == 'email':
+        return _limiter('email', 'ACCOUNTS_THROTTLE_EMAIL_LIMIT', 10)
+    return _limiter('ip', 'ACCOUNTS_THROTTLE_IP_LIMIT', 100)
+
+
+class CredentialAttemptThrottle(BaseThrottle):
+    """Rejects password attempts per email and per client IP before any hashing.
+
+    DRF runs throttles in ``initial()``, i.e. before the serializer calls
+    ``authenticate()`` or ``check_password()``.
+    """
+
+    def get_email(self, request):
+        if request.user and request.user.is_authenticated:
+            return request.user.email.lower()
+        email = request.data.get('email') if hasattr(request.data, 'get') else None
+        return email.strip().lower() if isinstance(email, str) else None
+
+    def allow_request(self, request, view):
+        self.wait_seconds = self.check(self.get_ident(request), self.get_email(request))
+        return not self.wait_seconds
+
+    def check(self, ident, email):
+        """Record an attempt and return the seconds to wait, 0 when allowed."""
+        wait = get_limiter('ip').hit(ident)
+        if not wait and email:
+            wait = get_limiter('email').hit(email)
+        return wait
+
+    def wait(self):
+        return self.wait_seconds
+
+
+def reset_email_attempts(email):
+    """Forget the attempts of a user who just authenticated successfully."""
+    get_limiter('email').reset(email.strip().lower())
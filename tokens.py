@@ -0,0 +1,18 @@
+from rest_framework_simplejwt.tokens import RefreshToken
+
+GENERATION_CLAIM = 'gen'
+
+
+def issue_tokens_for(user):
+    """Refresh/access pair carrying the user's token generation.
+
+    Bumping ``CustomUserModel.token_generation`` (see accounts.revocation)
+    revokes every token issued before, access tokens included since they
+    copy the claim from their refresh token.
+    """
+    refresh = RefreshToken.for_user(user)
+    refresh[GENERATION_CLAIM] = user.token_generation
+    return {
+        "refresh": str(refresh),
+        "access": str(refresh.access_token),
+    }
@@ -1,8 +1,9 @@
 from django.urls import path
-from .views import ChangePasswordView, EmailValidateRequestView, GoogleLoginView, LoginView, PasswordResetConfirmView, PasswordResetRequestView, SetPasswordView, UserRegistrationView, ActivateAccountView
+from .views import BulkRegistrationView, ChangePasswordView, EmailValidateRequestView, GoogleLoginView, LoginView, MeView, MetricsView, PasswordResetConfirmView, PasswordResetRequestView, SetPasswordView, TokenRefreshView, UserRegistrationView, ActivateAccountView
 
 urlpatterns = [
     path('register/', UserRegistrationView.as_view(), name='user-register'),
+    path('register/bulk/', BulkRegistrationView.as_view(), name='user-register-bulk'),
     path('activate/', ActivateAccountView.as_view(), name='activate-account'),
     path('validate/', EmailValidateRequestView.as_view(), name='email-validate'),
     path('login/', LoginView.as_view(), name='login'),
@@ -11,4 +12,7 @@ urlpatterns = [
     path('set-password/', SetPasswordView.as_view(), name='set-password'),
     path('password-reset/', PasswordResetRequestView.as_view(), name='password-reset'),
     path('password-reset/confirm/<uidb64>/<token>/', PasswordResetConfirmView.as_view(), name='password-reset-confirm'),
+    path('me/', MeView.as_view(), name='me'),
+    path('token/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
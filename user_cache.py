@@ -0,0 +1,110 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import CustomUserModel
+from .routers import pin_to_primary
+
+
+class UserCache:
+    """Two-level cache of user rows keyed by user id and cache version.
+
+    The shared cache holds a version stamp per user and the pickled row for
+    that version; a small in-process LRU sits in front of it. Bumping the
+    version (``invalidate``) makes every process refetch the row on the next
+    request, so a warm lookup costs one cache ``get`` and no query.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, cache_alias='default'):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _version_key(self, user_id):
+        return f'accounts:user-version:{user_id}'
+
+    def get_version(self, user_id):
+        key = self._version_key(user_id)
+        version = self.cache.get(key)
+        if version is None:
+            # A fresh stamp can never match a copy cached before eviction
+            self.cache.add(key, time.time_ns(), timeout=None)
+            version = self.cache.get(key)
+        return version
+
+    def invalidate(self, user_id):
+        self.cache.set(self._version_key(user_id), time.time_ns(), timeout=None)
+        with self._lock:
+            self._local.pop(user_id, None)
+
+    def get(self, user_id):
+        """Return a private copy of the user, or None if it doesn't exist."""
+        return self._get(user_id, self.get_version(user_id))
+
+    def get_derived(self, user_id, name, build):
+        """Return ``(version, build(user))``, computed once per user version.
+
+        The result is cached next to the row, so it is dropped by the same
+        ``invalidate``; ``build`` must return something picklable.
+        """
+        version = self.get_version(user_id)
+        key = f'accounts:user:{user_id}:{version}:{name}'
+        value = self.cache.get(key)
+        if value is None:
+            # The row is read after the version, it can't be older than it
+            user = self._get(user_id, version)
+            if user is None:
+                return version, None
+            value = build(user)
+            self.cache.set(key, value, timeout=self.ttl)
+        return version, value
+
+    def _get(self, user_id, version):
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._local.get(user_id)
+            if entry and entry[0] == version and entry[2] > now:
+                self._local.move_to_end(user_id)
+                return copy.copy(entry[1])
+
+        user_key = f'accounts:user:{user_id}:{version}'
+        user = self.cache.get(user_key)
+        if user is None:
+            # A lagging replica would cache the old row under the new version
+            with pin_to_primary():
+                user = CustomUserModel.objects.filter(pk=user_id).first()
+            if user is None:
+                return None
+            self.cache.set(user_key, user, timeout=self.ttl)
+
+        with self._lock:
+            self._local[user_id] = (version, user, now + self.ttl)
+            self._local.move_to_end(user_id)
+            while len(self._local) > self.maxsize:
+                self._local.popitem(last=False)
+        return copy.copy(user)
+
+
+@lru_cache(maxsize=None)
+def get_user_cache():
+    return UserCache(
+        maxsize=getattr(settings, 'ACCOUNTS_USER_CACHE_SIZE', 1024),
+        ttl=getattr(settings, 'ACCOUNTS_USER_CACHE_TTL', 300),
+        cache_alias=getattr(settings, 'ACCOUNTS_USER_CACHE', 'default'),
+    )
+
+
+def invalidate_user(user_id):
+    get_user_cache().invalidate(user_id)
@@ -3,46 +3,62 @@ from django.conf import settings
 from django.contrib.auth.tokens import default_token_generator
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from django.utils import timezone
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes
-from django.utils.crypto import get_random_string
+from django.utils.crypto import constant_time_compare
 from django.utils import encoding
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
 # Third-party imports
-import requests
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken
-
-from accounts.utils import send_activation_email, send_password_reset_email
+from rest_framework_simplejwt.views import TokenRefreshView as BaseTokenRefreshView
+
+from accounts.utils import build_activation_email, send_activation_email, send_password_reset_email
+from accounts.otp import issue_otp, issue_otps, consume_otp
+from accounts.outbox import queue_emails
+from accounts.google_oauth import GoogleOAuthError, get_google_client
+from accounts.throttling import CredentialAttemptThrottle, reset_email_attempts
+from accounts.activity import record_login
+from accounts.avatars import refresh_avatar
+from accounts.authentication import CachedJWTAuthentication
+from accounts.user_cache import invalidate_user
+from accounts.metrics import InstrumentedViewMixin, render_prometheus
+from accounts.coalescing import get_coalescer
+from accounts.revocation import revoke_tokens
+from accounts.tokens import issue_tokens_for
+from accounts.profiles import current_profile_etag, get_profile
+from accounts.hashing import get_hashing_service
 # Local imports
 from .models import CustomUserModel
 from .serializers import (
-    UserRegistrationSerializer, OTPVerificationSerializer,
+    UserRegistrationSerializer, BulkUserRowSerializer, BulkRegistrationSerializer, OTPVerificationSerializer,
     EmailValidateRequestSerializer, LoginSerializer,
     GoogleLoginSerializer, ChangePasswordSerializer,
     SetPasswordSerializer, PasswordResetRequestSerializer,
-    PasswordResetConfirmSerializer
+    PasswordResetConfirmSerializer, TokenRefreshSerializer
 )
 
 
 User = get_user_model()
 
-class UserRegistrationView(generics.CreateAPIView):
+class UserRegistrationView(InstrumentedViewMixin, generics.CreateAPIView):
     queryset = CustomUserModel.objects.all()
     serializer_class = UserRegistrationSerializer
 
     def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
         return Response({'message': 'Activation email has been sent successfully.'}, status=status.HTTP_201_CREATED)
 
+    @transaction.atomic
     def perform_create(self, serializer):
         user = serializer.save()
 
         # Generate OTP
-        otp_code = get_random_string(length=5, allowed_chars='1234567890')
-        user.otp_code = otp_code
-        user.otp_generated_at = timezone.now()
-        user.save()
+        otp_code = issue_otp(user.email)
 
         # Generate activation link
         activation_link = self.request.build_absolute_uri(reverse('activate-account')) + f'?otp={otp_code}&email={user.email}'
@@ -50,32 +66,98 @@ class UserRegistrationView(generics.CreateAPIView):
         # Send email with OTP and activation link
         send_activation_email(user.email, otp_code, activation_link)
 
-class EmailValidateRequestView(generics.CreateAPIView):
+class BulkRegistrationView(InstrumentedViewMixin, generics.CreateAPIView):
+    """Registers many users in one request and queues their activation emails.
+
+    Rows are validated independently and reported one by one: ``created``,
+    ``exists`` (already registered or repeated in the batch) or ``invalid``.
+    """
+    serializer_class = BulkRegistrationSerializer
+    authentication_classes = (CachedJWTAuthentication,)
+    permission_classes = (permissions.IsAdminUser,)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = self.perform_create(serializer)
+        created = sum(result['status'] == 'created' for result in results)
+        return Response({'created': created, 'results': results}, status=status.HTTP_201_CREATED)
+
+    def perform_create(self, serializer):
+        results = []
+        rows = {}
+        for data in serializer.validated_data['users']:
+            row = BulkUserRowSerializer(data=data)
+            if not row.is_valid():
+                results.append({'email': data.get('email'), 'status': 'invalid', 'errors': row.errors})
+                continue
+            email = CustomUserModel.objects.normalize_email(row.validated_data['email'])
+            results.append({'email': email, 'status': 'exists' if email in rows else 'created'})
+            rows.setdefault(email, row.validated_data)
+
+        existing = set(CustomUserModel.objects.filter(email__in=list(rows)).values_list('email', flat=True))
+        new_users = [
+            CustomUserModel(email=email, first_name=data['first_name'], last_name=data.get('last_name'))
+            for email, data in rows.items() if email not in existing
+        ]
+        # Hashed before the transaction opens, across the workers of a process
+        # pool hashing service. Invitees without a password pick one through
+        # the password reset flow.
+        passwords = get_hashing_service().hash_many([rows[user.email].get('password') for user in new_users])
+        for user, password in zip(new_users, passwords):
+            user.password = password
+
+        with transaction.atomic():
+            CustomUserModel.objects.bulk_create(new_users, ignore_conflicts=True)
+            # ignore_conflicts also skips emails a concurrent request inserted
+            # since the check above; the salted hashes tell our rows apart
+            stored = dict(CustomUserModel.objects.filter(email__in=[user.email for user in new_users]).values_list('email', 'password'))
+            inserted = {user.email for user in new_users if stored.get(user.email) == user.password}
+
+            codes = issue_otps(list(inserted))
+            activation_url = self.request.build_absolute_uri(reverse('activate-account'))
+            queue_emails(
+                build_activation_email(email, code, activation_url + f'?otp={code}&email={email}')
+                for email, code in codes.items()
+            )
+
+        for result in results:
+            if result['status'] == 'created' and result['email'] not in inserted:
+                result['status'] = 'exists'
+        return results
+
+class EmailValidateRequestView(InstrumentedViewMixin, generics.CreateAPIView):
     serializer_class = EmailValidateRequestSerializer
 
     def create(self, request, *args, **kwargs):
-        return Response({"message": "New OTP sent successfully."}, status=status.HTTP_201_CREATED)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        # Same answer for unknown emails, so the endpoint doesn't reveal which accounts exist
+        return Response({"message": "If an inactive account uses this email, a new OTP has been sent."}, status=status.HTTP_201_CREATED)
 
+    @transaction.atomic
     def perform_create(self, serializer):
         email = serializer.validated_data['email']
 
-        try:
-            user = CustomUserModel.objects.get(email=email, is_active=False)
-        except CustomUserModel.DoesNotExist:
-            return Response({"error": "User with this email not found or already activated."}, status=status.HTTP_404_NOT_FOUND)
+        user = CustomUserModel.objects.filter(email=email, is_active=False).first()
+        if user is None:
+            return
 
-        # Generate new OTP
-        otp_code = get_random_string(length=5, allowed_chars='1234567890')
-        user.otp_code = otp_code
-        user.otp_generated_at = timezone.now()
-        user.save()
+        with get_coalescer().claim('otp', user.email) as issue:
+            # A repeat inside the window keeps the OTP already in the user's inbox
+            if not issue:
+                return
 
-        # Send email with new OTP
-        activation_link = self.request.build_absolute_uri(reverse('activate-account')) + f'?otp={otp_code}&email={user.email}'
-        send_activation_email(user.email, otp_code, activation_link)
+            # Generate new OTP
+            otp_code = issue_otp(user.email)
 
+            # Send email with new OTP
+            activation_link = self.request.build_absolute_uri(reverse('activate-account')) + f'?otp={otp_code}&email={user.email}'
+            send_activation_email(user.email, otp_code, activation_link)
 
-class ActivateAccountView(generics.GenericAPIView):
+
+class ActivateAccountView(InstrumentedViewMixin, generics.GenericAPIView):
     serializer_class = OTPVerificationSerializer
 
     def get(self, request, *args, **kwargs):
@@ -90,42 +172,38 @@ class ActivateAccountView(generics.GenericAPIView):
     def post(self, request, *args, **kwargs):
         return self.activate_account(request.data.get('email'), request.data.get('otp'))
 
+    @transaction.atomic
     def activate_account(self, email, otp_code):
-        try:
-            user = CustomUserModel.objects.get(email=email)
-        except CustomUserModel.DoesNotExist:
-            return Response({"error": "User not found."}, status=status.HTTP_400_BAD_REQUEST)
+        # The code is checked and consumed in one indexed DELETE
+        email = CustomUserModel.objects.normalize_email(email)
+        if not consume_otp(email, otp_code):
+            return Response({"error": "Invalid or expired OTP."}, status=status.HTTP_400_BAD_REQUEST)
 
-        if user.otp_code != otp_code:
-            return Response({"error": "Invalid OTP."}, status=status.HTTP_400_BAD_REQUEST)
-
-        if user.otp_generated_at and user.otp_generated_at + timezone.timedelta(hours=3) < timezone.now():
-            return Response({"error": "OTP has expired. Please request a new OTP."}, status=status.HTTP_400_BAD_REQUEST)
+        user_id = CustomUserModel.objects.filter(email=email).values_list('pk', flat=True).first()
+        if user_id is None:
+            return Response({"error": "User not found."}, status=status.HTTP_400_BAD_REQUEST)
 
-        user.is_active = True
-        user.verified_email = True
-        user.save()
+        CustomUserModel.objects.filter(pk=user_id).update(is_active=True, verified_email=True)
+        # update() doesn't send post_save
+        invalidate_user(user_id)
 
         return Response({"message": "Your account has been activated successfully."}, status=status.HTTP_200_OK)
 
-class LoginView(generics.GenericAPIView):
+class LoginView(InstrumentedViewMixin, generics.GenericAPIView):
     serializer_class = LoginSerializer
+    throttle_classes = (CredentialAttemptThrottle,)
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']
+        reset_email_attempts(user.email)
+        record_login(user)
 
         # Generate JWT token
-        refresh = RefreshToken.for_user(user)
-        access_token = str(refresh.access_token)
+        return Response(issue_tokens_for(user), status=status.HTTP_200_OK)
 
-        return Response({
-            "refresh": str(refresh),
-            "access": access_token,
-        }, status=status.HTTP_200_OK)
-
-class GoogleLoginView(generics.GenericAPIView):
+class GoogleLoginView(InstrumentedViewMixin, generics.GenericAPIView):
     serializer_class = GoogleLoginSerializer
 
     def post(self, request, *args, **kwargs):
@@ -133,33 +211,11 @@ class GoogleLoginView(generics.GenericAPIView):
         serializer.is_valid(raise_exception=True)
         code = serializer.validated_data['code']
 
-        client_id = settings.GOOGLE_CLIENT_ID
-        client_secret = settings.GOOGLE_CLIENT_SECRET
-        redirect_uri = settings.GOOGLE_REDIRECT_URI
-
-        # Exchange the authorization code for an access token
-        token_response = requests.post(
-            'https://oauth2.googleapis.com/token',
-            data={
-                'code': code,
-                'client_id': client_id,
-                'client_secret': client_secret,
-                'redirect_uri': redirect_uri,
-                'grant_type': 'authorization_code'
-            }
-        )
-        token_json = token_response.json()
-        access_token = token_json.get('access_token')
-
-        if not access_token:
-            return Response({"error": "Failed to obtain access token."}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Use the access token to obtain user info
-        user_info_response = requests.get(
-            'https://www.googleapis.com/oauth2/v1/userinfo',
-            params={'access_token': access_token}
-        )
-        user_info = user_info_response.json()
+        try:
+            # Exchanges the code and verifies the returned id_token locally
+            user_info = get_google_client().get_user_info(code)
+        except GoogleOAuthError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
 
         # Extract relevant user information
         email = user_info.get('email')
@@ -172,41 +228,29 @@ class GoogleLoginView(generics.GenericAPIView):
         if not email:
             return Response({"error": "Failed to obtain user email."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Check if the user already exists in the database
-        user, created = User.objects.get_or_create(
-            email=email,
-            defaults={
-                'first_name': first_name,
-                'last_name': last_name,
-                'google_id': google_id,
-                'picture_url': picture_url,
-                'verified_email': verified_email,
-                'is_active': True,
-            }
+        # Writes only the Google profile columns that differ from what is stored,
+        # the Google id and picture URL go to the user's SocialIdentity
+        user, _ = User.objects.upsert_google_user(
+            email,
+            first_name=first_name,
+            last_name=last_name,
+            google_id=google_id,
+            picture_url=picture_url,
+            verified_email=verified_email,
         )
+        refresh_avatar(user)
 
-        if not created:
-            # Update user information if necessary
-            user.first_name = first_name
-            user.last_name = last_name
-            user.google_id = google_id
-            user.picture_url = picture_url
-            user.verified_email = verified_email
-            user.save()
+        record_login(user)
 
         # Generate JWT tokens for the user
-        refresh = RefreshToken.for_user(user)
-        access_token = str(refresh.access_token)
-
-        return Response({
-            "refresh": str(refresh),
-            "access": access_token,
-        }, status=status.HTTP_200_OK)
+        return Response(issue_tokens_for(user), status=status.HTTP_200_OK)
 
-class ChangePasswordView(generics.UpdateAPIView):
+class ChangePasswordView(InstrumentedViewMixin, generics.UpdateAPIView):
     serializer_class = ChangePasswordSerializer
     model = User
+    authentication_classes = (CachedJWTAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = (CredentialAttemptThrottle,)
 
     def get_object(self, queryset=None):
         return self.request.user
@@ -216,20 +260,23 @@ class ChangePasswordView(generics.UpdateAPIView):
         serializer = self.get_serializer(data=request.data)
 
         if serializer.is_valid():
-            # Check old password
-            if not self.object.check_password(serializer.data.get("old_password")):
-                return Response({"old_password": ["Wrong password."]}, status=status.HTTP_400_BAD_REQUEST)
+            # The serializer already checked the old password, don't hash it twice
+            reset_email_attempts(self.object.email)
 
             # set_password also hashes the password that the user will get
             self.object.set_password(serializer.data.get("new_password"))
-            self.object.save()
+            # request.user is a cached copy, only the password is known to be current
+            self.object.save(update_fields=['password'])
+            # Tokens issued with the old password stop working
+            revoke_tokens(self.object)
             return Response({"detail": "Password updated successfully"}, status=status.HTTP_200_OK)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class SetPasswordView(generics.UpdateAPIView):
+class SetPasswordView(InstrumentedViewMixin, generics.UpdateAPIView):
     serializer_class = SetPasswordSerializer
     model = User
+    authentication_classes = (CachedJWTAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_object(self, queryset=None):
@@ -242,36 +289,44 @@ class SetPasswordView(generics.UpdateAPIView):
         if serializer.is_valid():
             # set_password also hashes the password that the user will get
             self.object.set_password(serializer.data.get("new_password"))
-            self.object.save()
+            # request.user is a cached copy, only the password is known to be current
+            self.object.save(update_fields=['password'])
+            revoke_tokens(self.object)
             return Response({"detail": "Password set successfully"}, status=status.HTTP_200_OK)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class PasswordResetRequestView(generics.CreateAPIView):
+class PasswordResetRequestView(InstrumentedViewMixin, generics.CreateAPIView):
     serializer_class = PasswordResetRequestSerializer
 
     def create(self, request, *args, **kwargs):
-        return Response({"message": "Password reset email has been sent successfully."}, status=status.HTTP_200_OK)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        # Same answer for unknown emails, so the endpoint doesn't reveal which accounts exist
+        return Response({"message": "If an active account uses this email, a password reset link has been sent."}, status=status.HTTP_200_OK)
 
+    @transaction.atomic
     def perform_create(self, serializer):
         email = serializer.validated_data['email']
 
-        try:
-            user = CustomUserModel.objects.get(email=email, is_active=True)
-        except CustomUserModel.DoesNotExist:
-            return Response({"error": "No active user found with this email."}, status=status.HTTP_404_NOT_FOUND)
+        user = CustomUserModel.objects.filter(email=email, is_active=True).first()
+        if user is None:
+            return
+
+        with get_coalescer().claim('password_reset', user.email) as issue:
+            # A repeat inside the window keeps the link already in the user's inbox
+            if not issue:
+                return
 
-        # Generate a password reset token and save it to the user
-        token = default_token_generator.make_token(user)
-        user.reset_password_token = token
-        user.reset_password_token_created_at = timezone.now()
-        user.save()
+            # The token is derived from the user's state, nothing needs to be stored
+            token = default_token_generator.make_token(user)
 
-        # Send password reset email with token link
-        reset_link = self.request.build_absolute_uri(reverse('password-reset-confirm', kwargs={'uidb64': urlsafe_base64_encode(force_bytes(user.pk)), 'token': token}))
-        send_password_reset_email(user.email, reset_link)
+            # Send password reset email with token link
+            reset_link = self.request.build_absolute_uri(reverse('password-reset-confirm', kwargs={'uidb64': urlsafe_base64_encode(force_bytes(user.pk)), 'token': token}))
+            send_password_reset_email(user.email, reset_link)
 
-class PasswordResetConfirmView(generics.UpdateAPIView):
+class PasswordResetConfirmView(InstrumentedViewMixin, generics.UpdateAPIView):
     serializer_class = PasswordResetConfirmSerializer
 
     def update(self, request, *args, **kwargs):
@@ -282,7 +337,7 @@ class PasswordResetConfirmView(generics.UpdateAPIView):
         token = kwargs['token']
 
         try:
-            uid = encoding.force_text(urlsafe_base64_decode(uidb64))
+            uid = encoding.force_str(urlsafe_base64_decode(uidb64))
             user = CustomUserModel.objects.get(pk=uid)
         except (TypeError, ValueError, OverflowError, CustomUserModel.DoesNotExist):
             return Response({"error": "Invalid user id or token."}, status=status.HTTP_400_BAD_REQUEST)
@@ -292,6 +347,43 @@ class PasswordResetConfirmView(generics.UpdateAPIView):
             new_password = serializer.validated_data['new_password']
             user.set_password(new_password)
             user.save()
+            revoke_tokens(user)
+            # The outstanding link is now void, let the next request send a new one
+            get_coalescer().release('password_reset', user.email)
             return Response({"message": "Password has been reset successfully."}, status=status.HTTP_200_OK)
         else:
             return Response({"error": "Invalid token. Please request a new password reset."}, status=status.HTTP_400_BAD_REQUEST)
+
+class TokenRefreshView(InstrumentedViewMixin, BaseTokenRefreshView):
+    serializer_class = TokenRefreshSerializer
+
+class MeView(InstrumentedViewMixin, generics.GenericAPIView):
+    permission_classes = (permissions.IsAuthenticated,)
+    authentication_classes = (CachedJWTAuthentication,)
+
+    def get(self, request, *args, **kwargs):
+        # A client holding the current version gets a 304 without serializing anything
+        etag = current_profile_etag(request.user.pk)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            etag, payload = get_profile(request.user.pk)
+            response = Response(payload, status=status.HTTP_200_OK)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+class MetricsPermission(permissions.BasePermission):
+    """Requires ``Authorization: Bearer <ACCOUNTS_METRICS_TOKEN>``."""
+
+    def has_permission(self, request, view):
+        token = getattr(settings, 'ACCOUNTS_METRICS_TOKEN', None)
+        if not token:
+            return settings.DEBUG
+        return constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}')
+
+class MetricsView(generics.GenericAPIView):
+    authentication_classes = ()
+    permission_classes = (MetricsPermission,)
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')